@@ -0,0 +1,103 @@
+import os
+import io
+import csv
+import zlib
+from typing import Any, AsyncIterator, Dict, List
+import pyarrow as pa
+import pyarrow.parquet as pq
+from starlette.concurrency import run_in_threadpool
+from models import AttendanceRecord
+from pagination import KEYSET_SORT
+
+# Records pulled from the Motor cursor and encoded per chunk (and per Parquet row group)
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+EXPORT_COLUMNS = [
+    "_id", "student_id", "roll_no", "name", "class_name", "section", "teacher_name",
+    "subject_name", "date", "class_time", "time", "status"
+]
+EXPORT_SCHEMA = pa.schema([(column, pa.string()) for column in EXPORT_COLUMNS])
+
+async def _record_chunks(query: Dict[str, Any]) -> AsyncIterator[List[Dict[str, Any]]]:
+    """Yields the matching raw records in lists of at most EXPORT_CHUNK_SIZE."""
+    cursor = AttendanceRecord.get_motor_collection().find(query).sort(KEYSET_SORT).batch_size(EXPORT_CHUNK_SIZE)
+    chunk = []
+    async for doc in cursor:
+        doc["_id"] = str(doc["_id"])
+        chunk.append(doc)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _csv_rows(docs: List[Dict[str, Any]], header: bool) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(EXPORT_COLUMNS)
+    writer.writerows([[doc.get(column) for column in EXPORT_COLUMNS] for doc in docs])
+    return buffer.getvalue().encode()
+
+async def stream_attendance_csv(query: Dict[str, Any], gzip: bool = False) -> AsyncIterator[bytes]:
+    """Streams the matching records as CSV, optionally gzip-compressed, one chunk at a time."""
+    # wbits=31 writes a gzip (not raw zlib) stream
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    header = True
+    async for docs in _record_chunks(query):
+        data = _csv_rows(docs, header)
+        header = False
+        yield compressor.compress(data) if compressor else data
+    if header:
+        # No records matched: still send the header row
+        data = _csv_rows([], True)
+        yield compressor.compress(data) if compressor else data
+    if compressor:
+        yield compressor.flush()
+
+class _StreamSink(io.RawIOBase):
+    """Write-only file that hands out whatever was written since the last `drain`."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        # ParquetWriter records absolute offsets, so report the total written, not what is buffered
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def stream_attendance_parquet(query: Dict[str, Any], gzip: bool = False) -> AsyncIterator[bytes]:
+    """Streams the matching records as a Parquet file, writing one row group per chunk.
+
+    `gzip` selects the gzip column codec instead of snappy; the file itself stays uncompressed.
+    """
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, EXPORT_SCHEMA, compression="gzip" if gzip else "snappy")
+
+    def write_chunk(docs):
+        table = pa.Table.from_pydict(
+            {column: [None if doc.get(column) is None else str(doc[column]) for doc in docs] for column in EXPORT_COLUMNS},
+            schema=EXPORT_SCHEMA
+        )
+        writer.write_table(table)
+        return sink.drain()
+
+    try:
+        async for docs in _record_chunks(query):
+            yield await run_in_threadpool(write_chunk, docs)
+    finally:
+        writer.close()
+    yield sink.drain()
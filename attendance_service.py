@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+from typing import List, Dict, Set, Tuple, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from models import AttendanceRecord, ATTENDANCE_SESSION_KEY
+from attendance_summary import count_new_records
+from database import write_errors_excluding_duplicates
+
+# Cached sessions unused for this long are dropped even if never closed
+ATTENDANCE_SESSION_CACHE_IDLE_SECONDS = float(os.getenv("ATTENDANCE_SESSION_CACHE_IDLE_SECONDS", "14400"))
+
+# (class_name, section, subject_name, date, class_time)
+SessionKey = Tuple[str, str, Optional[str], str, Optional[str]]
+
+def session_key(record: AttendanceRecord) -> SessionKey:
+    return record.class_name, record.section, record.subject_name, record.date, record.class_time
+
+async def upsert_attendance_records(records: List[AttendanceRecord]) -> List[bool]:
+    """Inserts each record unless one already exists for its student and session.
+
+    All records go out in a single unordered bulk write of `$setOnInsert`
+    upserts keyed on ATTENDANCE_SESSION_KEY, so existing records are never
+    modified. Returns, per record, whether it was newly inserted; inserted
+    records get their `id` set.
+    """
+    if not records:
+        return []
+
+    operations = []
+    for record in records:
+        key = {field: getattr(record, field) for field in ATTENDANCE_SESSION_KEY}
+        operations.append(UpdateOne(key, {"$setOnInsert": record.dict(exclude={"id", "revision_id"})}, upsert=True))
+
+    try:
+        result = await AttendanceRecord.get_motor_collection().bulk_write(operations, ordered=False)
+        upserted_ids = result.upserted_ids
+    except BulkWriteError as e:
+        # Two requests racing on the same session both try to insert; the loser hits the
+        # unique index, which just means the student is already marked.
+        if write_errors_excluding_duplicates(e):
+            raise
+        upserted_ids = {upsert["index"]: upsert["_id"] for upsert in e.details["upserted"]}
+
+    inserted = []
+    for index, record in enumerate(records):
+        if index in upserted_ids:
+            record.id = upserted_ids[index]
+            inserted.append(True)
+        else:
+            inserted.append(False)
+    return inserted
+
+async def insert_attendance_records(records: List[AttendanceRecord]) -> List[bool]:
+    """Inserts records with one unordered insert_many, skipping any that hit the unique session index.
+
+    Returns, per record, whether it was inserted; inserted records get their `id` set.
+    """
+    if not records:
+        return []
+
+    documents = [record.dict(exclude={"id", "revision_id"}) for record in records]
+    failed = set()
+    try:
+        await AttendanceRecord.get_motor_collection().insert_many(documents, ordered=False)
+    except BulkWriteError as e:
+        if write_errors_excluding_duplicates(e):
+            raise
+        failed = {error["index"] for error in e.details["writeErrors"]}
+
+    inserted = []
+    for index, (record, document) in enumerate(zip(records, documents)):
+        if index in failed:
+            inserted.append(False)
+        else:
+            # insert_many fills in the generated _id on each document
+            record.id = document["_id"]
+            inserted.append(True)
+    return inserted
+
+class AttendanceSessionCache:
+    """In-process set of student IDs already marked in each class session.
+
+    A session's set is seeded from MongoDB the first time it is needed and
+    then kept up to date from upsert results, so a student recognized again
+    on later frames costs a set lookup instead of a database round trip.
+    Sessions are dropped by `close` or after sitting idle.
+    """
+
+    def __init__(self, idle_seconds: float = ATTENDANCE_SESSION_CACHE_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._marked: Dict[SessionKey, Set[str]] = {}
+        self._last_used: Dict[SessionKey, float] = {}
+        self._seed_locks: Dict[SessionKey, asyncio.Lock] = {}
+
+    def _expire_idle(self, now: float):
+        for key in [key for key, last_used in self._last_used.items() if now - last_used > self.idle_seconds]:
+            self.close(key)
+
+    async def marked_students(self, key: SessionKey) -> Set[str]:
+        """Returns the (live, mutable) set of student IDs marked in session `key`."""
+        now = time.monotonic()
+        self._expire_idle(now)
+        self._last_used[key] = now
+        if key in self._marked:
+            return self._marked[key]
+
+        lock = self._seed_locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            if key not in self._marked:
+                query = dict(zip(("class_name", "section", "subject_name", "date", "class_time"), key))
+                cursor = AttendanceRecord.get_motor_collection().find(query, {"student_id": 1, "_id": 0})
+                self._marked[key] = {doc["student_id"] async for doc in cursor}
+        return self._marked[key]
+
+    def close(self, key: SessionKey):
+        self._marked.pop(key, None)
+        self._last_used.pop(key, None)
+        self._seed_locks.pop(key, None)
+
+attendance_sessions = AttendanceSessionCache()
+
+async def mark_students_present(records: List[AttendanceRecord]) -> List[bool]:
+    """Marks recognized students present, skipping MongoDB for students the session cache already has.
+
+    Returns, per record, whether it was newly inserted.
+    """
+    inserted_flags = [False] * len(records)
+    to_write = []
+    for index, record in enumerate(records):
+        marked = await attendance_sessions.marked_students(session_key(record))
+        if record.student_id not in marked:
+            to_write.append(index)
+
+    results = await upsert_attendance_records([records[index] for index in to_write])
+    for index, inserted in zip(to_write, results):
+        inserted_flags[index] = inserted
+        # Inserted or found already existing: either way the student is marked now
+        (await attendance_sessions.marked_students(session_key(records[index]))).add(records[index].student_id)
+    await count_new_records([record for record, inserted in zip(records, inserted_flags) if inserted])
+    return inserted_flags
+
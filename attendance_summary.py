@@ -0,0 +1,75 @@
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+from models import AttendanceRecord, AttendanceSummary, ATTENDANCE_SUMMARY_KEY
+from database import get_change_counter, bump_change_counter
+
+# Status -> summary counter it contributes to (other statuses, e.g. "Leave", only count toward total)
+STATUS_COUNTERS = {"Present": "present_count", "Absent": "absent_count"}
+
+def _summary_update(record: AttendanceRecord, increments: Dict[str, int]) -> UpdateOne:
+    key = {field: getattr(record, field) for field in ATTENDANCE_SUMMARY_KEY}
+    # Every counter is always incremented (by 0 if unchanged) so an upserted row has all of them
+    increments = {"present_count": 0, "absent_count": 0, "total": 0, **increments}
+    return UpdateOne(key, {"$inc": increments, "$set": {"name": record.name}}, upsert=True)
+
+async def count_new_records(records: List[AttendanceRecord]):
+    """Adds freshly inserted records to the summary counters."""
+    operations = []
+    for record in records:
+        increments = {"total": 1}
+        if record.status in STATUS_COUNTERS:
+            increments[STATUS_COUNTERS[record.status]] = 1
+        operations.append(_summary_update(record, increments))
+    if operations:
+        await AttendanceSummary.get_motor_collection().bulk_write(operations, ordered=False)
+
+async def count_status_change(record: AttendanceRecord, old_status: str):
+    """Moves one record's contribution from `old_status` to its current status."""
+    if old_status == record.status:
+        return
+    increments = {}
+    if old_status in STATUS_COUNTERS:
+        increments[STATUS_COUNTERS[old_status]] = -1
+    if record.status in STATUS_COUNTERS:
+        increments[STATUS_COUNTERS[record.status]] = 1
+    if increments:
+        await AttendanceSummary.get_motor_collection().bulk_write([_summary_update(record, increments)])
+
+async def check_summary_seeded():
+    """Warns when attendance records predate the summary and rebuild_attendance_summary.py has not run yet.
+
+    A completed rebuild bumps the summary's change counter; a new database is
+    marked here, since its counters grow along with its records.
+    """
+    if await get_change_counter(AttendanceSummary.Settings.name):
+        return
+    if await AttendanceRecord.get_motor_collection().find_one({}, {"_id": 1}) is None:
+        await bump_change_counter(AttendanceSummary.Settings.name)
+        return
+    print("WARNING: attendance summary counters were never built from existing records; "
+          "/attendance/summary/by_subject_and_section is incomplete until `python rebuild_attendance_summary.py` runs.")
+
+def _percentage(present_count: int, total: int) -> float:
+    return round(present_count / total * 100, 1) if total else 0
+
+async def read_summary(class_name: str, section: str) -> List[Dict[str, Any]]:
+    """Returns the per-subject summary for a class section from the materialized counters.
+
+    Same shape as the by-subject aggregation: [{"subject_name", "records": [...]}].
+    """
+    by_subject: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    cursor = AttendanceSummary.get_motor_collection().find(
+        {"class_name": class_name, "section": section},
+        {"_id": 0, "subject_name": 1, "roll_no": 1, "name": 1, "present_count": 1, "absent_count": 1, "total": 1}
+    )
+    async for doc in cursor:
+        if not doc["total"]:
+            continue
+        by_subject.setdefault(doc.get("subject_name"), []).append({
+            "roll_no": doc["roll_no"],
+            "name": doc["name"],
+            "present_count": doc["present_count"],
+            "absent_count": doc["absent_count"],
+            "percentage": _percentage(doc["present_count"], doc["total"])
+        })
+    return [{"subject_name": subject_name, "records": records} for subject_name, records in by_subject.items()]
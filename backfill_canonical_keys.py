@@ -0,0 +1,78 @@
+import os
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from database import initiate_database, bump_change_counter, write_errors_excluding_duplicates
+from models import Student, AttendanceRecord, normalize_key
+from rebuild_attendance_summary import reconcile_attendance_summary
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+BATCH_SIZE = 500 # Documents updated per bulk_write
+
+# Collection model -> fields stored in normalize_key form
+CANONICAL_FIELDS = [
+    (Student, ("class_name", "section")),
+    (AttendanceRecord, ("class_name", "section", "teacher_name", "subject_name")),
+]
+
+async def _flush(collection, operations) -> int:
+    """Writes a batch; returns how many updates collided with an existing canonical record."""
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        if write_errors_excluding_duplicates(e):
+            raise
+        return len(e.details["writeErrors"])
+    return 0
+
+async def backfill_collection(model, fields, dry_run: bool) -> int:
+    collection = model.get_motor_collection()
+    operations = []
+    scanned = 0
+    converted = 0
+    collisions = 0
+    async for doc in collection.find({}, {field: 1 for field in fields}):
+        scanned += 1
+        changes = {field: normalize_key(doc[field]) for field in fields if doc.get(field) is not None and normalize_key(doc[field]) != doc[field]}
+        if not changes:
+            continue
+        converted += 1
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+        if len(operations) >= BATCH_SIZE and not dry_run:
+            collisions += await _flush(collection, operations)
+            operations = []
+
+    if operations and not dry_run:
+        collisions += await _flush(collection, operations)
+
+    action = "Would normalize" if dry_run else "Normalized"
+    print(f"{action} {converted - collisions} of {scanned} {model.Settings.name} documents.")
+    if collisions:
+        # e.g. "BSCS" and "bscs" records for the same student and session: the canonical one is kept
+        print(f"Left {collisions} {model.Settings.name} documents unchanged: a record with the same canonical key already exists.")
+    return converted - collisions
+
+async def backfill_canonical_keys(dry_run: bool = False):
+    await initiate_database(MONGO_URI, DATABASE_NAME)
+    changed = {}
+    for model, fields in CANONICAL_FIELDS:
+        changed[model] = await backfill_collection(model, fields, dry_run)
+
+    if not dry_run and changed[Student]:
+        # Other workers reload the embedding gallery so its metadata shows the new keys
+        await bump_change_counter(Student.Settings.name)
+    # Summary rows were keyed on the old spellings; recount them under the canonical keys
+    await reconcile_attendance_summary(dry_run)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rewrite class/section/subject/teacher fields in their canonical (normalize_key) form.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report how many documents would change.")
+    args = parser.parse_args()
+
+    asyncio.run(backfill_canonical_keys(args.dry_run))
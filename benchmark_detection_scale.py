@@ -0,0 +1,83 @@
+import os
+import time
+import argparse
+import cv2
+import numpy as np
+from face_service import detect_face_locations, filter_face_locations
+
+# Benchmarks HOG detection latency vs. recall at several FACE_DETECTION_SCALE values.
+# Recall is measured against the boxes found at full resolution (scale 1.0).
+
+IMAGES_DIR = "student_images"
+DEFAULT_SCALES = [1.0, 0.75, 0.5, 0.35, 0.25]
+IOU_THRESHOLD = 0.5 # A scaled detection counts as the same face above this overlap
+
+def box_iou(a, b) -> float:
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    intersection = max(0, right - left) * max(0, bottom - top)
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    union = area_a + area_b - intersection
+    return intersection / union if union else 0.0
+
+def load_images(images_dir: str, upscale: float):
+    images = []
+    for filename in sorted(os.listdir(images_dir)):
+        if not filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+            continue
+        img = cv2.imread(os.path.join(images_dir, filename))
+        if img is None:
+            continue
+        if upscale != 1.0:
+            img = cv2.resize(img, (0, 0), fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+        images.append((filename, cv2.cvtColor(img, cv2.COLOR_BGR2RGB)))
+    return images
+
+def detect(rgb_image, scale):
+    started = time.perf_counter()
+    locations = filter_face_locations(detect_face_locations(rgb_image, scale))
+    return locations, (time.perf_counter() - started) * 1000
+
+def run_benchmark(images_dir: str, scales, upscale: float, repeat: int):
+    images = load_images(images_dir, upscale)
+    if not images:
+        print(f"No images found in {images_dir}.")
+        return
+    height, width = images[0][1].shape[:2]
+    print(f"{len(images)} images from {images_dir} (first is {width}x{height}), {repeat} run(s) per scale\n")
+
+    baseline = {filename: detect(rgb_image, 1.0)[0] for filename, rgb_image in images}
+    baseline_faces = sum(len(boxes) for boxes in baseline.values())
+
+    print(f"{'scale':>6} {'mean ms':>9} {'p95 ms':>8} {'speedup':>8} {'faces':>6} {'recall':>7}")
+    full_scale_mean = None
+    for scale in scales:
+        latencies = []
+        found = 0
+        matched = 0
+        for filename, rgb_image in images:
+            for _ in range(repeat):
+                boxes, latency_ms = detect(rgb_image, scale)
+                latencies.append(latency_ms)
+            found += len(boxes)
+            matched += sum(1 for ref in baseline[filename] if any(box_iou(ref, box) >= IOU_THRESHOLD for box in boxes))
+
+        mean_ms = float(np.mean(latencies))
+        if full_scale_mean is None:
+            full_scale_mean = mean_ms
+        recall = matched / baseline_faces if baseline_faces else 0.0
+        print(f"{scale:>6.2f} {mean_ms:>9.2f} {np.percentile(latencies, 95):>8.2f} {full_scale_mean / mean_ms:>7.2f}x {found:>6} {recall:>7.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure face detection latency vs. recall across detection scales.")
+    parser.add_argument("--images_dir", type=str, default=IMAGES_DIR,
+                        help="Directory of test images (default: student_images).")
+    parser.add_argument("--scales", type=float, nargs="+", default=DEFAULT_SCALES,
+                        help="Detection scales to compare; the first one is the speedup reference.")
+    parser.add_argument("--upscale", type=float, default=1.0,
+                        help="Enlarge every image first, e.g. 6 to simulate high-resolution camera frames.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timed runs per image and scale.")
+    args = parser.parse_args()
+
+    run_benchmark(args.images_dir, args.scales, args.upscale, args.repeat)
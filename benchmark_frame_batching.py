@@ -0,0 +1,98 @@
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from gallery import EmbeddingGallery
+from embedding_index import EMBEDDING_DIM, create_index
+from frame_batcher import MicroBatcher
+
+# Synthetic load generator for the /attend/process_frame micro-batching scheduler.
+# Detection/encoding is simulated by a fixed per-frame delay on a bounded worker
+# pool (like the face process pool); gallery matching runs for real.
+
+DEFAULT_CONFIGS = ["1:0", "4:2", "8:5", "16:10"] # max_batch_size:max_wait_ms
+
+def build_gallery(students: int, backend: str) -> EmbeddingGallery:
+    rng = np.random.default_rng(0)
+    matrix = (rng.standard_normal((students, EMBEDDING_DIM)) * 0.1).astype(np.float32)
+    metadata = [
+        {"student_id": str(i), "roll_no": str(i), "name": f"Student {i}", "class_name": f"class {i % 50}", "section": "a"}
+        for i in range(students)
+    ]
+    gallery = EmbeddingGallery(create_index(backend))
+    row_slots = np.arange(students, dtype=np.int64)
+    gallery._set_rows(matrix, metadata, row_slots)
+    gallery.index.reset(row_slots, gallery.matrix)
+    gallery.loaded = True
+    return gallery
+
+def make_frames(gallery: EmbeddingGallery, count: int, faces_per_frame: int):
+    rng = np.random.default_rng(1)
+    frames = []
+    for _ in range(count):
+        rows = rng.integers(0, len(gallery), size=faces_per_frame)
+        noise = rng.standard_normal((faces_per_frame, EMBEDDING_DIM)).astype(np.float32) * 0.01
+        frames.append(list(gallery.matrix[rows] + noise))
+    return frames
+
+async def run_load(gallery, frames, max_batch_size, max_wait_ms, rate, encode_ms, workers):
+    loop = asyncio.get_running_loop()
+    encode_pool = ThreadPoolExecutor(max_workers=workers)
+    match_pool = ThreadPoolExecutor(max_workers=1)
+
+    def fake_encode(face_encodings):
+        time.sleep(encode_ms / 1000)
+        return face_encodings
+
+    async def process_batch(batch):
+        encoded = await asyncio.gather(*[loop.run_in_executor(encode_pool, fake_encode, f) for f in batch])
+        results, _ = await loop.run_in_executor(match_pool, gallery.match_batch, [(f, None, None) for f in encoded])
+        return results
+
+    batcher = MicroBatcher(process_batch, max_batch_size, max_wait_ms)
+    latencies = []
+
+    async def one_request(face_encodings):
+        started = time.perf_counter()
+        await batcher.submit(face_encodings)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    started = time.perf_counter()
+    for face_encodings in frames:
+        tasks.append(asyncio.ensure_future(one_request(face_encodings)))
+        await asyncio.sleep(random.expovariate(rate)) # Poisson arrivals
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    encode_pool.shutdown()
+    match_pool.shutdown()
+    return len(frames) / elapsed, np.percentile(latencies, 50), np.percentile(latencies, 99), batcher.stats()["mean_batch_size"]
+
+async def main(args):
+    random.seed(0)
+    gallery = build_gallery(args.students, args.backend)
+    frames = make_frames(gallery, args.requests, args.faces)
+    print(f"{args.requests} frames x {args.faces} faces, gallery {args.students} ({args.backend}), "
+          f"{args.rate} req/s offered, {args.encode_ms} ms simulated encode on {args.workers} workers\n")
+    print(f"{'batch':>6} {'wait ms':>8} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8} {'mean batch':>11}")
+    for config in args.configs:
+        max_batch_size, max_wait_ms = config.split(":")
+        throughput, p50, p99, mean_batch = await run_load(
+            gallery, frames, int(max_batch_size), float(max_wait_ms), args.rate, args.encode_ms, args.workers
+        )
+        print(f"{max_batch_size:>6} {max_wait_ms:>8} {throughput:>8.1f} {p50:>8.1f} {p99:>8.1f} {mean_batch:>11}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput vs. p99 latency of frame micro-batching under synthetic load.")
+    parser.add_argument("--students", type=int, default=50000, help="Synthetic gallery size.")
+    parser.add_argument("--backend", type=str, default="flat", help="Gallery index backend (flat or ivf).")
+    parser.add_argument("--requests", type=int, default=300, help="Number of frames to send.")
+    parser.add_argument("--faces", type=int, default=40, help="Faces per frame.")
+    parser.add_argument("--rate", type=float, default=40.0, help="Offered load in frames per second.")
+    parser.add_argument("--encode_ms", type=float, default=20.0, help="Simulated detection + encoding time per frame.")
+    parser.add_argument("--workers", type=int, default=4, help="Simulated face worker processes.")
+    parser.add_argument("--configs", type=str, nargs="+", default=DEFAULT_CONFIGS,
+                        help="Batching configs as max_batch_size:max_wait_ms.")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,219 @@
+import os
+import asyncio
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+from typing import BinaryIO, Optional, Set
+from gridfs.errors import NoFile
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo import ReturnDocument
+from models import BulkRegistrationJob
+from bulk_registration import open_roster, register_rows
+
+# Rows between progress commits; at most this many rows are redone after a restart
+BULK_JOB_COMMIT_ROWS = int(os.getenv("BULK_JOB_COMMIT_ROWS", "50"))
+# How long a worker's claim on a job lasts unless renewed; a running job renews it on a timer
+BULK_JOB_LEASE_SECONDS = float(os.getenv("BULK_JOB_LEASE_SECONDS", "300"))
+
+UNFINISHED_STATUSES = ["queued", "running"]
+ROSTER_BUCKET = "bulk_job_rosters" # GridFS bucket; any server process can resume any job
+STOP_TIMEOUT_SECONDS = 10 # Time a cancelled job gets to release its lease on shutdown
+LEASE_RENEWALS = 3 # Lease renewals per BULK_JOB_LEASE_SECONDS, so a slow batch never lets it expire
+
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+_lease_retries: Set[asyncio.TimerHandle] = set()
+
+class LeaseLost(Exception):
+    """Another worker took over the job after this worker's lease expired."""
+    pass
+
+def _roster_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(BulkRegistrationJob.get_motor_collection().database, bucket_name=ROSTER_BUCKET)
+
+def _count_rows(filename: str, upload: BinaryIO) -> int:
+    """Validates a roster and counts its rows, one chunk at a time, then rewinds it."""
+    total_rows = sum(1 for _ in open_roster(filename, upload))
+    upload.seek(0)
+    return total_rows
+
+async def create_job(filename: str, upload: BinaryIO) -> BulkRegistrationJob:
+    """Validates an uploaded roster, stores it in GridFS and queues it; raises ValueError for unusable files."""
+    total_rows = await asyncio.to_thread(_count_rows, filename, upload)
+    roster_file_id = await _roster_bucket().upload_from_stream(filename, upload)
+    job = BulkRegistrationJob(filename=filename, roster_file_id=roster_file_id, total_rows=total_rows)
+    await job.insert()
+    _queue.put_nowait(job.id)
+    return job
+
+async def _claim(job_id) -> Optional[BulkRegistrationJob]:
+    """Takes ownership of an unfinished job unless another worker holds a live lease on it.
+
+    Each claim gets a new lease_owner token; progress and completion are only
+    written while the job still carries it.
+    """
+    now = datetime.utcnow()
+    doc = await BulkRegistrationJob.get_motor_collection().find_one_and_update(
+        {
+            "_id": job_id,
+            "status": {"$in": UNFINISHED_STATUSES},
+            "$or": [{"lease_until": None}, {"lease_until": {"$lt": now}}]
+        },
+        {"$set": {
+            "status": "running",
+            "lease_until": now + timedelta(seconds=BULK_JOB_LEASE_SECONDS),
+            "lease_owner": uuid.uuid4().hex,
+            "started_at": now
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    return BulkRegistrationJob.parse_obj(doc) if doc else None
+
+async def _retry_after_lease(job_id):
+    """Re-queues a job whose lease is held elsewhere for when the lease runs out.
+
+    The holder may be another server process, or a worker that crashed
+    without releasing it; either way the job is claimed once the lease
+    expires without a progress commit.
+    """
+    doc = await BulkRegistrationJob.get_motor_collection().find_one(
+        {"_id": job_id, "status": {"$in": UNFINISHED_STATUSES}}, {"lease_until": 1}
+    )
+    if doc is None:
+        return
+    lease_until = doc.get("lease_until") or datetime.utcnow()
+    delay = max(0.0, (lease_until - datetime.utcnow()).total_seconds()) + 1
+    loop = asyncio.get_running_loop()
+
+    def requeue():
+        _lease_retries.discard(handle)
+        _queue.put_nowait(job_id)
+    handle = loop.call_later(delay, requeue)
+    _lease_retries.add(handle)
+
+def _owned(job: BulkRegistrationJob) -> dict:
+    return {"_id": job.id, "lease_owner": job.lease_owner}
+
+async def _keep_lease(job: BulkRegistrationJob):
+    """Extends the lease on a timer while the job runs, until the lease is lost."""
+    while True:
+        await asyncio.sleep(BULK_JOB_LEASE_SECONDS / LEASE_RENEWALS)
+        try:
+            result = await BulkRegistrationJob.get_motor_collection().update_one(
+                _owned(job), {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=BULK_JOB_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            print(f"Bulk registration job {job.id}: could not renew the lease: {e}")
+            continue
+        if result.matched_count == 0:
+            # The next progress commit raises LeaseLost and stops the run
+            return
+
+async def _commit(job: BulkRegistrationJob, last_row: int, processed: int, successful: int, failed: list, rows_per_second: float):
+    result = await BulkRegistrationJob.get_motor_collection().update_one(_owned(job), {
+        "$inc": {"processed_rows": processed, "successful_count": successful},
+        "$push": {"failed_records": {"$each": failed}},
+        "$set": {
+            "last_committed_row": last_row,
+            "rows_per_second": round(rows_per_second, 2),
+            "lease_until": datetime.utcnow() + timedelta(seconds=BULK_JOB_LEASE_SECONDS)
+        }
+    })
+    if result.matched_count == 0:
+        raise LeaseLost()
+
+async def _finish(job: BulkRegistrationJob, status: str, error: Optional[str] = None):
+    result = await BulkRegistrationJob.get_motor_collection().update_one(_owned(job), {
+        "$set": {"status": status, "error": error, "lease_until": None, "lease_owner": None, "finished_at": datetime.utcnow()}
+    })
+    if result.matched_count == 0:
+        raise LeaseLost()
+    if job.roster_file_id is not None:
+        try:
+            await _roster_bucket().delete(job.roster_file_id)
+        except NoFile:
+            pass
+
+async def run_job(job_id):
+    job = await _claim(job_id)
+    if job is None:
+        await _retry_after_lease(job_id)
+        return
+    if job.last_committed_row > 1:
+        print(f"Bulk registration job {job.id}: resuming after row {job.last_committed_row} of {job.filename}.")
+    else:
+        print(f"Bulk registration job {job.id}: started on {job.filename} ({job.total_rows} rows).")
+    # Local scratch copy of the roster for this run, removed when it is closed
+    roster = tempfile.TemporaryFile()
+    lease = asyncio.ensure_future(_keep_lease(job))
+    try:
+        if job.roster_file_id is None:
+            raise ValueError("The roster was stored on a server's local disk by an older version; upload it again.")
+        await _roster_bucket().download_to_stream(job.roster_file_id, roster)
+        roster.seek(0)
+        # Rows up to the last commit were already saved by an earlier run
+        remaining = (roster_row for roster_row in open_roster(job.filename, roster) if roster_row.row > job.last_committed_row)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        done_this_run = 0
+        processed, successful, failed = 0, 0, [] # Since the last commit
+        async for roster_row, saved, row_failed in register_rows(remaining):
+            processed += 1
+            successful += saved
+            failed.extend(row_failed)
+            done_this_run += 1
+            if processed >= BULK_JOB_COMMIT_ROWS:
+                rate = done_this_run / max(loop.time() - started, 1e-6)
+                await _commit(job, roster_row.row, processed, successful, failed, rate)
+                processed, successful, failed = 0, 0, []
+        if processed:
+            rate = done_this_run / max(loop.time() - started, 1e-6)
+            await _commit(job, roster_row.row, processed, successful, failed, rate)
+        await _finish(job, "completed")
+        print(f"Bulk registration job {job.id} completed.")
+    except asyncio.CancelledError:
+        # Shutting down: give up the lease so the next start resumes from the last commit right away
+        await BulkRegistrationJob.get_motor_collection().update_one(_owned(job), {"$set": {"lease_until": None, "lease_owner": None}})
+        raise
+    except LeaseLost:
+        # Rows since the last commit are redone by the new owner; student upserts make that harmless
+        print(f"Bulk registration job {job.id}: lease taken over by another worker, stopping this run.")
+    except Exception as e:
+        print(f"Bulk registration job {job.id} failed: {e}")
+        try:
+            await _finish(job, "failed", str(e))
+        except LeaseLost:
+            print(f"Bulk registration job {job.id}: lease taken over by another worker, not marking it failed.")
+    finally:
+        lease.cancel()
+        roster.close()
+
+async def _work():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await run_job(job_id)
+        except Exception as e:
+            print(f"Bulk registration job {job_id} could not be run: {e}")
+
+async def start_bulk_jobs():
+    """Starts the background job worker and re-queues jobs left unfinished by a previous run."""
+    global _queue, _worker
+    _queue = asyncio.Queue()
+    unfinished = BulkRegistrationJob.get_motor_collection().find({"status": {"$in": UNFINISHED_STATUSES}}, {"_id": 1}).sort("created_at", 1)
+    async for doc in unfinished:
+        _queue.put_nowait(doc["_id"])
+    if not _queue.empty():
+        print(f"Resuming {_queue.qsize()} unfinished bulk registration jobs.")
+    _worker = asyncio.ensure_future(_work())
+
+async def stop_bulk_jobs():
+    global _worker
+    for handle in _lease_retries:
+        handle.cancel()
+    _lease_retries.clear()
+    if _worker is not None:
+        # Wait for the running job to release its lease before the process exits
+        _worker.cancel()
+        await asyncio.wait({_worker}, timeout=STOP_TIMEOUT_SECONDS)
+        _worker = None
@@ -0,0 +1,225 @@
+import os
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+import httpx
+import pandas as pd
+from face_workers import encode_registration_image
+from models import FaceEmbedding, normalize_key
+from student_service import StudentWrite, upsert_students
+
+# Image downloads in flight across all rows, and per image host
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "16"))
+IMAGE_FETCH_PER_HOST = int(os.getenv("IMAGE_FETCH_PER_HOST", "4"))
+IMAGE_FETCH_TIMEOUT_SECONDS = float(os.getenv("IMAGE_FETCH_TIMEOUT_SECONDS", "10"))
+# Extra attempts after a timeout, connection error, 429 or 5xx
+IMAGE_FETCH_RETRIES = int(os.getenv("IMAGE_FETCH_RETRIES", "2"))
+# Rows downloaded/encoded ahead of the row being saved
+BULK_PIPELINE_WINDOW = int(os.getenv("BULK_PIPELINE_WINDOW", "64"))
+# Roster rows parsed per CSV chunk
+ROSTER_CHUNK_ROWS = int(os.getenv("ROSTER_CHUNK_ROWS", "1000"))
+# Students saved per bulk upsert
+STUDENT_WRITE_BATCH_SIZE = int(os.getenv("STUDENT_WRITE_BATCH_SIZE", "200"))
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+@dataclass
+class RosterRow:
+    """One student row of a bulk registration sheet; `row` is the spreadsheet row number (header is row 1)."""
+    row: int
+    roll_no: str
+    name: str
+    class_name: str
+    section: str
+    image_url: str = ""
+
+    def is_complete(self) -> bool:
+        return bool(self.roll_no and self.name and self.class_name and self.section)
+
+@dataclass
+class PreparedRow:
+    """A roster row after its image was downloaded and encoded."""
+    roster_row: RosterRow
+    embeddings: List[FaceEmbedding] = field(default_factory=list)
+    error: Optional[str] = None # Image problem; the student is still saved without embeddings
+
+REQUIRED_COLUMNS = {'roll_no', 'name', 'class_name', 'section'}
+ROSTER_COLUMNS = ['roll_no', 'name', 'class_name', 'section', 'image']
+
+def _roster_chunks(filename: str, source) -> Iterator[pd.DataFrame]:
+    if filename.endswith('.csv'):
+        # Parsed ROSTER_CHUNK_ROWS rows at a time. Cells stay text ("" when empty), so a
+        # roll number like 007 isn't turned into 7.0 and a blank cell isn't "nan".
+        return pd.read_csv(source, chunksize=ROSTER_CHUNK_ROWS, dtype=str, keep_default_na=False)
+    if filename.endswith(('.xls', '.xlsx')):
+        # Excel has no incremental reader; the sheet is parsed in one go
+        return iter([pd.read_excel(source, dtype=str)])
+    raise ValueError("Unsupported file type. Please upload a CSV or Excel file.")
+
+def _normalize_columns(chunk: pd.DataFrame) -> pd.DataFrame:
+    chunk.columns = chunk.columns.str.strip().str.lower().str.replace(' ', '_')
+    return chunk
+
+def _chunk_rows(chunk: pd.DataFrame) -> Iterator[RosterRow]:
+    # Whole-column string cleanup; only the RosterRow construction is per row
+    fields = chunk.reindex(columns=ROSTER_COLUMNS, fill_value="").fillna("").astype(str)
+    fields = fields.apply(lambda column: column.str.strip())
+    row_numbers = chunk.index + 2
+    for row, roll_no, name, class_name, section, image_url in zip(row_numbers, *(fields[column] for column in ROSTER_COLUMNS)):
+        yield RosterRow(int(row), roll_no, name, class_name, section, image_url)
+
+def open_roster(filename: str, source) -> Iterator[RosterRow]:
+    """Reads a CSV/Excel roster (path or file object) as a lazy stream of rows.
+
+    The header is checked right away and raises ValueError for unusable files;
+    the rows themselves are parsed chunk by chunk as they are consumed.
+    """
+    chunks = _roster_chunks(filename, source)
+    first_chunk = _normalize_columns(next(chunks))
+    if not REQUIRED_COLUMNS.issubset(first_chunk.columns):
+        missing_cols = REQUIRED_COLUMNS - set(first_chunk.columns)
+        raise ValueError(f"Missing required columns in file: {', '.join(missing_cols)}. Required: roll_no, name, class_name, section.")
+
+    def rows():
+        yield from _chunk_rows(first_chunk)
+        for chunk in chunks:
+            yield from _chunk_rows(_normalize_columns(chunk))
+    return rows()
+
+class ImageFetchError(Exception):
+    pass
+
+_client: Optional[httpx.AsyncClient] = None
+_fetch_slots: Optional[asyncio.Semaphore] = None
+_host_slots: Dict[str, asyncio.Semaphore] = {}
+
+def get_image_client() -> httpx.AsyncClient:
+    """Shared HTTP client for roster image downloads, created on first use."""
+    global _client, _fetch_slots
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(IMAGE_FETCH_TIMEOUT_SECONDS),
+            limits=httpx.Limits(max_connections=IMAGE_FETCH_CONCURRENCY, max_keepalive_connections=IMAGE_FETCH_CONCURRENCY),
+            follow_redirects=True
+        )
+        _fetch_slots = asyncio.Semaphore(IMAGE_FETCH_CONCURRENCY)
+    return _client
+
+async def close_image_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+        _host_slots.clear()
+
+async def fetch_image(url: str) -> bytes:
+    """Downloads an image, retrying transient failures with exponential backoff."""
+    client = get_image_client()
+    host_slots = _host_slots.setdefault(urlsplit(url).netloc, asyncio.Semaphore(IMAGE_FETCH_PER_HOST))
+    for attempt in range(IMAGE_FETCH_RETRIES + 1):
+        last_attempt = attempt == IMAGE_FETCH_RETRIES
+        try:
+            # Host slot first: a download queued behind a busy host must not hold a global slot while it waits
+            async with host_slots, _fetch_slots:
+                response = await client.get(url)
+        except httpx.TransportError:
+            if last_attempt:
+                raise
+        else:
+            if response.status_code == 200:
+                return response.content
+            if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                raise ImageFetchError(f"Failed to download image from {url}")
+        await asyncio.sleep(0.5 * 2 ** attempt)
+
+async def prepare_row(roster_row: RosterRow) -> PreparedRow:
+    """Downloads and encodes a row's image; image problems are recorded on the row, not raised."""
+    prepared = PreparedRow(roster_row)
+    url = roster_row.image_url
+    if not url or not roster_row.is_complete():
+        return prepared
+    try:
+        image_bytes = await fetch_image(url)
+        face_encodings = await encode_registration_image(image_bytes)
+        if face_encodings is None:
+            prepared.error = f"Invalid image format at {url}"
+        elif not face_encodings:
+            prepared.error = f"No face found in image at {url}"
+        else:
+            prepared.embeddings.append(FaceEmbedding.from_numpy(face_encodings[0]))
+    except ImageFetchError as e:
+        prepared.error = str(e)
+    except Exception as e:
+        prepared.error = f"Error downloading/processing image: {str(e)}"
+    return prepared
+
+async def prepare_rows(roster_rows: Iterable[RosterRow], window: int = BULK_PIPELINE_WINDOW) -> AsyncIterator[PreparedRow]:
+    """Yields prepared rows in sheet order while up to `window` later rows download and encode."""
+    in_flight = deque()
+    try:
+        for roster_row in roster_rows:
+            in_flight.append(asyncio.ensure_future(prepare_row(roster_row)))
+            if len(in_flight) >= window:
+                yield await in_flight.popleft()
+        while in_flight:
+            yield await in_flight.popleft()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+def _student_write(prepared: PreparedRow) -> StudentWrite:
+    roster_row = prepared.roster_row
+    # Class/section are refreshed on every upload; embeddings only when the row brought a face
+    set_fields = {"class_name": normalize_key(roster_row.class_name), "section": normalize_key(roster_row.section)}
+    insert_fields = {}
+    embeddings = [embedding.dict() for embedding in prepared.embeddings]
+    if embeddings:
+        set_fields["face_embeddings"] = embeddings
+    else:
+        insert_fields["face_embeddings"] = []
+    return StudentWrite(roster_row.roll_no, roster_row.name, set_fields, insert_fields)
+
+async def register_rows(roster_rows: Iterable[RosterRow]) -> AsyncIterator[Tuple[RosterRow, bool, List[Dict[str, object]]]]:
+    """Registers rows in sheet order, yielding (row, saved, failed_records) once each row is committed.
+
+    Complete rows are saved STUDENT_WRITE_BATCH_SIZE at a time with one bulk upsert.
+    """
+    buffered: List[PreparedRow] = []
+
+    async def flush():
+        complete = [prepared for prepared in buffered if prepared.roster_row.is_complete()]
+        write_results = iter(await upsert_students([_student_write(prepared) for prepared in complete]))
+        for prepared in buffered:
+            roster_row = prepared.roster_row
+            # Skip if any crucial field is empty
+            if not roster_row.is_complete():
+                yield roster_row, False, [{"row": roster_row.row, "message": "Missing required data (roll_no, name, class_name, or section)"}]
+                continue
+            failed = [{"row": roster_row.row, "message": prepared.error}] if prepared.error else []
+            result = next(write_results)
+            if result.error:
+                failed.append({"row": roster_row.row, "message": f"Database error: {result.error}"})
+            yield roster_row, result.error is None, failed
+        buffered.clear()
+
+    complete_count = 0
+    async for prepared in prepare_rows(roster_rows):
+        buffered.append(prepared)
+        complete_count += prepared.roster_row.is_complete()
+        if complete_count >= STUDENT_WRITE_BATCH_SIZE:
+            async for outcome in flush():
+                yield outcome
+            complete_count = 0
+    async for outcome in flush():
+        yield outcome
+
+async def register_roster_rows(roster_rows: Iterable[RosterRow]) -> Tuple[int, List[Dict[str, object]]]:
+    """Registers every row; returns (successful_count, failed_records) in sheet order."""
+    successful_uploads = 0
+    failed_uploads = []
+    async for _, saved, failed in register_rows(roster_rows):
+        successful_uploads += saved
+        failed_uploads.extend(failed)
+    return successful_uploads, failed_uploads
@@ -0,0 +1,96 @@
+import os
+import sys
+import asyncio
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from database import initiate_database
+from models import Student, AttendanceRecord, AttendanceSummary
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+
+# Query shapes issued by the API endpoints: (endpoint, document model, filter, sort).
+# Paginated report endpoints sort on the (date, _id) keyset.
+# Values are placeholders; only the fields matter to the query planner.
+ENDPOINT_QUERIES = [
+    ("GET /admin/students/{roll_no}", Student, {"roll_no": "1"}, None),
+    ("GET /students/filter", Student, {"class_name": "c", "section": "s"}, None),
+    ("POST /attendance/close_session (students)", Student, {"class_name": "c", "section": "s"}, None),
+    ("POST /attendance/close_session (records)", AttendanceRecord,
+     {"class_name": "c", "section": "s", "subject_name": "m", "date": "2024-01-01", "class_time": "09:00"}, None),
+    ("POST /attend/process_frame (session upsert)", AttendanceRecord,
+     {"student_id": "x", "class_name": "c", "section": "s", "subject_name": "m", "date": "2024-01-01", "class_time": "09:00"}, None),
+    ("GET /attendance/{roll_no}", AttendanceRecord, {"roll_no": "1"}, [("date", 1), ("_id", 1)]),
+    ("GET /attendance/{roll_no}/{subject_name}", AttendanceRecord, {"roll_no": "1", "subject_name": "m"}, [("date", 1)]),
+    ("POST /attendance/manual", AttendanceRecord, {"roll_no": "1", "subject_name": "m", "date": "2024-01-01"}, None),
+    ("GET /attendance/report/class", AttendanceRecord,
+     {"class_name": "c", "section": "s", "subject_name": "m", "date": "2024-01-01"}, None),
+    ("GET /attendance/report/all (date)", AttendanceRecord, {"date": "2024-01-01"}, [("date", 1), ("_id", 1)]),
+    ("GET /attendance/report/all (from_date/to_date)", AttendanceRecord,
+     {"recorded_at": {"$gte": datetime(2024, 1, 1), "$lt": datetime(2024, 2, 1)}}, [("date", 1), ("_id", 1)]),
+    ("GET /attendance/report/all (class)", AttendanceRecord, {"class_name": "c", "section": "s"}, [("date", 1), ("_id", 1)]),
+    ("GET /attendance/summary/by_subject_and_section", AttendanceSummary, {"class_name": "c", "section": "s"}, None),
+    ("GET /attendance/summary/by_subject_and_section (teacher)", AttendanceRecord,
+     {"class_name": "c", "section": "s", "teacher_name": "t"}, None),
+    ("GET /attendance/by_teacher_class_section", AttendanceRecord,
+     {"teacher_name": "t", "class_name": "c", "section": "s"}, [("date", 1), ("_id", 1)]),
+]
+
+def plan_stages(plan) -> list:
+    """Collects every stage name in an explain plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+def index_names(plan) -> list:
+    names = []
+    if isinstance(plan, dict):
+        if "indexName" in plan:
+            names.append(plan["indexName"])
+        for value in plan.values():
+            names.extend(index_names(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            names.extend(index_names(item))
+    return names
+
+async def check_query_indexes(verbose: bool = False) -> int:
+    # initiate_database creates the declared indexes, so the plans reflect them
+    await initiate_database(MONGO_URI, DATABASE_NAME)
+
+    collection_scans = 0
+    for endpoint, model, query, sort in ENDPOINT_QUERIES:
+        cursor = model.get_motor_collection().find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        winning_plan = explain["queryPlanner"]["winningPlan"]
+        stages = plan_stages(winning_plan)
+        if "COLLSCAN" in stages:
+            collection_scans += 1
+            print(f"COLLSCAN  {endpoint}  filter={query}")
+        else:
+            print(f"OK        {endpoint}  index={','.join(index_names(winning_plan))}")
+        if verbose:
+            print(f"          stages: {' <- '.join(stages)}")
+
+    print(f"\n{collection_scans} of {len(ENDPOINT_QUERIES)} endpoint queries fall back to a collection scan.")
+    return collection_scans
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Explain every endpoint query shape and flag the ones that do a collection scan.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Also print the stages of each winning plan.")
+    args = parser.parse_args()
+
+    sys.exit(1 if asyncio.run(check_query_indexes(args.verbose)) else 0)
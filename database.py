@@ -1,8 +1,60 @@
+import uuid
 from motor.motor_asyncio import AsyncIOMotorClient
 from beanie import init_beanie
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from typing import List, Union
-from models import Student, AttendanceRecord
+from models import Student, AttendanceRecord, AttendanceSummary, BulkRegistrationJob, ChangeCounter
+
+DUPLICATE_KEY_ERROR = 11000
+
+def write_errors_excluding_duplicates(error: BulkWriteError) -> List[dict]:
+    """The write errors of an unordered bulk write other than unique-index (duplicate key) violations."""
+    return [write_error for write_error in error.details["writeErrors"] if write_error["code"] != DUPLICATE_KEY_ERROR]
 
 async def initiate_database(mongo_uri: str, database_name: str):
     client = AsyncIOMotorClient(mongo_uri)
-    await init_beanie(database=client[database_name], document_models=[Student, AttendanceRecord]) 
\ No newline at end of file
+    try:
+        await init_beanie(database=client[database_name], document_models=[Student, AttendanceRecord, AttendanceSummary, BulkRegistrationJob, ChangeCounter])
+    except DuplicateKeyError as e:
+        # A unique index can't be built over duplicates written by older versions
+        raise RuntimeError(
+            "Existing duplicate records block a unique index. "
+            "Run dedupe_student_roll_numbers.py and dedupe_attendance_sessions.py first (see \"Upgrading an existing database\" in the README)."
+        ) from e
+
+async def get_change_counter(collection: str) -> int:
+    """Returns the current write counter for `collection` (0 if it was never bumped)."""
+    doc = await ChangeCounter.get_motor_collection().find_one({"collection": collection})
+    return doc["counter"] if doc else 0
+
+async def get_change_epoch(collection: str) -> str:
+    """Returns the random id fixed when `collection`'s counter document was created.
+
+    A counter that restarts (new database, dropped change_counters) gets a new
+    epoch, so (epoch, counter) never names two different states.
+    """
+    counters = ChangeCounter.get_motor_collection()
+    doc = await counters.find_one({"collection": collection})
+    if doc is None or not doc.get("epoch"):
+        # Counters created before epochs existed get one on first use
+        try:
+            await counters.update_one(
+                {"collection": collection, "epoch": None},
+                {"$set": {"epoch": uuid.uuid4().hex}, "$setOnInsert": {"counter": 0}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass # Another worker set it first
+        doc = await counters.find_one({"collection": collection})
+    return doc["epoch"]
+
+async def bump_change_counter(collection: str) -> int:
+    """Atomically increments and returns the write counter for `collection`."""
+    doc = await ChangeCounter.get_motor_collection().find_one_and_update(
+        {"collection": collection},
+        {"$inc": {"counter": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["counter"]
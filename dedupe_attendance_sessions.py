@@ -0,0 +1,68 @@
+import os
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from models import AttendanceRecord, AttendanceSummary, ATTENDANCE_SESSION_KEY
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+BATCH_SIZE = 500 # Duplicate records deleted per delete_many
+
+# Must run before the server starts on a database written by an older version: the
+# unique_student_session index can't be built while duplicates exist, so this script
+# talks to MongoDB directly instead of calling initiate_database.
+
+def _keeper(records: list) -> dict:
+    """The record kept for a session: the oldest non-Absent one, else the oldest."""
+    return next((record for record in records if record.get("status") != "Absent"), records[0])
+
+async def _delete(collection, ids: list, dry_run: bool) -> int:
+    if dry_run:
+        return len(ids)
+    return (await collection.delete_many({"_id": {"$in": ids}})).deleted_count
+
+async def dedupe_attendance_sessions(dry_run: bool = False):
+    client = AsyncIOMotorClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+    collection = db[AttendanceRecord.Settings.name]
+
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        # $ifNull: the unique index treats a missing field and null as the same value
+        {"$group": {
+            "_id": {field: {"$ifNull": [f"${field}", None]} for field in ATTENDANCE_SESSION_KEY},
+            "records": {"$push": {"_id": "$_id", "status": "$status"}},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+
+    sessions = 0
+    duplicate_ids = []
+    removed = 0
+    async for group in collection.aggregate(pipeline, allowDiskUse=True):
+        sessions += 1
+        keep = _keeper(group["records"])
+        duplicate_ids.extend(record["_id"] for record in group["records"] if record["_id"] != keep["_id"])
+        if len(duplicate_ids) >= BATCH_SIZE:
+            removed += await _delete(collection, duplicate_ids, dry_run)
+            duplicate_ids = []
+    if duplicate_ids:
+        removed += await _delete(collection, duplicate_ids, dry_run)
+
+    action = "Would remove" if dry_run else "Removed"
+    print(f"{action} {removed} duplicate attendance records from {sessions} sessions.")
+    if removed and not dry_run and await db[AttendanceSummary.Settings.name].estimated_document_count():
+        print("Attendance summary counters include the removed records; run rebuild_attendance_summary.py.")
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove duplicate attendance records (same student and class session) so the unique session index can be built.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report how many records would be removed.")
+    args = parser.parse_args()
+
+    asyncio.run(dedupe_attendance_sessions(args.dry_run))
@@ -0,0 +1,91 @@
+import os
+import asyncio
+import sys
+import argparse
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from models import Student, AttendanceRecord, ChangeCounter, normalize_key
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+
+# Must run before the server starts on a database written by an older version, which
+# registered a new student whenever the (roll_no, name) pair was new, so "Ali Khan" and
+# "ali  khan" became two students. The unique roll_no index can't be built over those
+# duplicates, so this script talks to MongoDB directly instead of calling initiate_database.
+
+async def dedupe_student_roll_numbers(dry_run: bool = False) -> bool:
+    """Merges same-name duplicates; returns False, changing nothing, if any roll_no is shared by different names."""
+    client = AsyncIOMotorClient(MONGO_URI)
+    db = client[DATABASE_NAME]
+    students = db[Student.Settings.name]
+    records = db[AttendanceRecord.Settings.name]
+
+    pipeline = [
+        {"$sort": {"_id": 1}},
+        {"$group": {
+            "_id": "$roll_no",
+            "students": {"$push": {"_id": "$_id", "name": "$name", "embeddings": {"$size": {"$ifNull": ["$face_embeddings", []]}}}},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+
+    # Same roll_no and the same name up to case/spacing is one student registered twice; different
+    # names may be different people, whose faces must never be merged
+    merges = []
+    conflicts = []
+    async for group in students.aggregate(pipeline, allowDiskUse=True):
+        if len({normalize_key(student["name"]) for student in group["students"]}) == 1:
+            merges.append(group)
+        else:
+            conflicts.append(group)
+
+    if conflicts:
+        for group in conflicts:
+            names = ", ".join(f"{student['name']!r} ({student['_id']}, {student['embeddings']} embeddings)" for student in group["students"])
+            print(f"Roll No {group['_id']} is registered to different names: {names}.")
+        print(f"Nothing was changed. Resolve these {len(conflicts)} roll numbers by hand (correct the roll_no, "
+              f"or delete the wrong registration), then run this script again.")
+        client.close()
+        return False
+
+    merged = 0
+    for group in merges:
+        # The earliest registration keeps the roll_no; later ones are merged into it
+        keep, duplicates = group["students"][0], group["students"][1:]
+        duplicate_ids = [student["_id"] for student in duplicates]
+        print(f"Roll No {group['_id']}: keeping {keep['name']!r} ({keep['_id']}), merging {len(duplicates)} later registrations.")
+        merged += len(duplicates)
+        if dry_run:
+            continue
+
+        embeddings = []
+        async for student in students.find({"_id": {"$in": duplicate_ids}}, {"face_embeddings": 1}):
+            embeddings.extend(student.get("face_embeddings", []))
+        if embeddings:
+            await students.update_one({"_id": keep["_id"]}, {"$push": {"face_embeddings": {"$each": embeddings}}})
+        await records.update_many(
+            {"student_id": {"$in": [str(student_id) for student_id in duplicate_ids]}},
+            {"$set": {"student_id": str(keep["_id"])}}
+        )
+        await students.delete_many({"_id": {"$in": duplicate_ids}})
+
+    action = "Would merge" if dry_run else "Merged"
+    print(f"{action} {merged} students into the earlier registration of the same roll number.")
+    if merged and not dry_run:
+        # Running servers and gallery snapshots reload the changed students
+        await db[ChangeCounter.Settings.name].update_one({"collection": Student.Settings.name}, {"$inc": {"counter": 1}}, upsert=True)
+    client.close()
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge students registered more than once under the same roll number and name so the unique roll_no index can be built.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only list the duplicate roll numbers and what would be merged.")
+    args = parser.parse_args()
+
+    if not asyncio.run(dedupe_student_roll_numbers(args.dry_run)):
+        sys.exit(1)
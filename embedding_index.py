@@ -0,0 +1,313 @@
+import time
+import random
+import threading
+import numpy as np
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import List, Dict, Any, Tuple
+from face_service import MATCH_TOLERANCE, match_face_encodings, squared_distance_matrix
+
+EMBEDDING_DIM = 128
+
+# IVF defaults; nlist=0 picks roughly sqrt(N) lists when the index is trained
+IVF_DEFAULT_NPROBE = 8
+IVF_MIN_TRAIN_SIZE = 1024 # Below this many vectors the IVF index behaves like a flat scan
+IVF_KMEANS_ITERATIONS = 10
+
+def _empty_ids() -> np.ndarray:
+    return np.empty(0, dtype=np.int64)
+
+def _empty_vectors() -> np.ndarray:
+    return np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+
+def _lookup_ids(ids: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Maps row indices (-1 for no match) to the ids stored at those rows."""
+    found = np.full(len(indices), -1, dtype=np.int64)
+    matched = indices >= 0
+    found[matched] = ids[indices[matched]]
+    return found
+
+class EmbeddingIndex(ABC):
+    """Base class for nearest-neighbour indexes over gallery embeddings.
+
+    Vectors are keyed by integer ids chosen by the caller. `search` returns
+    the id of the nearest vector for every query, or -1 when nothing lies
+    within `tolerance`. Implementations replace their arrays instead of
+    mutating them, so a search running in a worker thread is never
+    disturbed by a concurrent add/remove.
+    """
+
+    name = "base"
+
+    def __init__(self):
+        # search() runs in threadpool threads; the lock guards the stats it records
+        self._stats_lock = threading.Lock()
+        self._latencies_ms = deque(maxlen=1000)
+        self.search_count = 0
+        self.query_count = 0
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    @abstractmethod
+    def _empty_like(self) -> "EmbeddingIndex":
+        ...
+
+    def empty_copy(self) -> "EmbeddingIndex":
+        """A new, empty index with the same settings that continues this one's search stats."""
+        copy = self._empty_like()
+        copy._stats_lock = self._stats_lock
+        copy._latencies_ms = self._latencies_ms
+        with self._stats_lock:
+            copy.search_count = self.search_count
+            copy.query_count = self.query_count
+        return copy
+
+    @property
+    def needs_training(self) -> bool:
+        """True once `add` has grown the index enough that it should be rebuilt with `reset`."""
+        return False
+
+    @abstractmethod
+    def reset(self, ids: np.ndarray, vectors: np.ndarray):
+        ...
+
+    @abstractmethod
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        ...
+
+    @abstractmethod
+    def remove(self, ids: np.ndarray):
+        ...
+
+    @abstractmethod
+    def _search(self, queries: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+        ...
+
+    def search(self, queries: np.ndarray, tolerance: float = MATCH_TOLERANCE) -> Tuple[np.ndarray, np.ndarray]:
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        started = time.perf_counter()
+        ids, distances = self._search(queries, tolerance)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._latencies_ms.append(elapsed_ms)
+            self.search_count += 1
+            self.query_count += queries.shape[0]
+        return ids, distances
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            latencies_ms = list(self._latencies_ms)
+            search_count, query_count = self.search_count, self.query_count
+        latencies = np.array(latencies_ms) if latencies_ms else np.zeros(1)
+        return {
+            "backend": self.name,
+            "size": len(self),
+            "searches": search_count,
+            "queries": query_count,
+            "latency_ms": {
+                "mean": round(float(latencies.mean()), 3),
+                "p50": round(float(np.percentile(latencies, 50)), 3),
+                "p99": round(float(np.percentile(latencies, 99)), 3),
+                "max": round(float(latencies.max()), 3)
+            }
+        }
+
+class FlatIndex(EmbeddingIndex):
+    """Exact brute-force search over one contiguous matrix."""
+
+    name = "flat"
+
+    def __init__(self):
+        super().__init__()
+        self._state = (_empty_ids(), _empty_vectors())
+
+    def __len__(self) -> int:
+        return self._state[0].shape[0]
+
+    def _empty_like(self) -> "FlatIndex":
+        return FlatIndex()
+
+    def reset(self, ids: np.ndarray, vectors: np.ndarray):
+        # Keeps a reference to `vectors` (no copy) so the gallery matrix is shared.
+        self._state = (np.asarray(ids, dtype=np.int64), np.ascontiguousarray(vectors, dtype=np.float32))
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        current_ids, current_vectors = self._state
+        self._state = (
+            np.concatenate([current_ids, np.asarray(ids, dtype=np.int64)]),
+            np.concatenate([current_vectors, np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)])
+        )
+
+    def remove(self, ids: np.ndarray):
+        current_ids, current_vectors = self._state
+        keep = ~np.isin(current_ids, ids)
+        if not keep.all():
+            self._state = (current_ids[keep], current_vectors[keep])
+
+    def _search(self, queries: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+        ids, vectors = self._state
+        best_indices, best_distances = match_face_encodings(queries, vectors, tolerance)
+        return _lookup_ids(ids, best_indices), best_distances
+
+class IVFIndex(EmbeddingIndex):
+    """Inverted-file ANN index: k-means coarse quantizer plus per-list exact scans.
+
+    Each query is compared against the `nprobe` closest centroids and only
+    the vectors in those lists are scanned, so cost grows with
+    N * nprobe / nlist instead of N. New vectors are assigned to their
+    nearest existing centroid; the quantizer is trained only by `reset`.
+    Once `add` has doubled the index since the last training,
+    `needs_training` tells the owner to rebuild it (k-means is slow enough
+    that the gallery does this off the event loop).
+
+    A `recall_sample_rate` fraction of searches is replayed against an exact
+    scan to keep a running top-1 recall estimate in `stats()`.
+    """
+
+    name = "ivf"
+
+    def __init__(self, nlist: int = 0, nprobe: int = IVF_DEFAULT_NPROBE, recall_sample_rate: float = 0.05):
+        super().__init__()
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.recall_sample_rate = recall_sample_rate
+        # (centroids, [(ids, vectors) per list]) swapped as one tuple; an
+        # untrained index has no centroids and a single list.
+        self._state: Tuple[np.ndarray, List[Tuple[np.ndarray, np.ndarray]]] = (_empty_vectors(), [(_empty_ids(), _empty_vectors())])
+        self._trained_size = 0
+        self._recall_checked = 0
+        self._recall_hits = 0
+
+    def __len__(self) -> int:
+        return sum(list_ids.shape[0] for list_ids, _ in self._state[1])
+
+    def _empty_like(self) -> "IVFIndex":
+        return IVFIndex(self.nlist, self.nprobe, self.recall_sample_rate)
+
+    def empty_copy(self) -> "IVFIndex":
+        copy = super().empty_copy()
+        copy._recall_checked = self._recall_checked
+        copy._recall_hits = self._recall_hits
+        return copy
+
+    @property
+    def needs_training(self) -> bool:
+        size = len(self)
+        if not self._trained_size:
+            return size >= IVF_MIN_TRAIN_SIZE
+        return size >= 2 * self._trained_size
+
+    def _all(self) -> Tuple[np.ndarray, np.ndarray]:
+        lists = self._state[1]
+        return np.concatenate([l[0] for l in lists]), np.concatenate([l[1] for l in lists])
+
+    def _train(self, ids: np.ndarray, vectors: np.ndarray):
+        n = vectors.shape[0]
+        if n < IVF_MIN_TRAIN_SIZE:
+            self._state = (_empty_vectors(), [(ids, vectors)])
+            self._trained_size = 0
+            return
+
+        nlist = min(self.nlist or max(1, int(np.sqrt(n))), n)
+        rng = np.random.default_rng(0)
+        centroids = vectors[rng.choice(n, size=nlist, replace=False)].copy()
+        for _ in range(IVF_KMEANS_ITERATIONS):
+            assignments = np.argmin(squared_distance_matrix(vectors, centroids), axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, vectors)
+            counts = np.bincount(assignments, minlength=nlist)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        assignments = np.argmin(squared_distance_matrix(vectors, centroids), axis=1)
+
+        order = np.argsort(assignments, kind="stable")
+        splits = np.cumsum(np.bincount(assignments, minlength=nlist))[:-1]
+        lists = list(zip(np.split(ids[order], splits), np.split(vectors[order], splits)))
+        self._state = (centroids, lists)
+        self._trained_size = n
+        print(f"IVF index trained: {n} vectors in {nlist} lists.")
+
+    def reset(self, ids: np.ndarray, vectors: np.ndarray):
+        self._train(np.asarray(ids, dtype=np.int64), np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM))
+
+    def add(self, ids: np.ndarray, vectors: np.ndarray):
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        if not len(ids):
+            return
+
+        centroids, lists = self._state
+        lists = list(lists)
+        if centroids.shape[0]:
+            assignments = np.argmin(squared_distance_matrix(vectors, centroids), axis=1)
+        else:
+            assignments = np.zeros(len(ids), dtype=np.intp)
+        for list_no in np.unique(assignments):
+            list_ids, list_vectors = lists[list_no]
+            members = assignments == list_no
+            lists[list_no] = (np.concatenate([list_ids, ids[members]]), np.concatenate([list_vectors, vectors[members]]))
+        self._state = (centroids, lists)
+
+    def remove(self, ids: np.ndarray):
+        if not len(ids):
+            return
+        centroids, lists = self._state
+        lists = list(lists)
+        for list_no, (list_ids, list_vectors) in enumerate(lists):
+            keep = ~np.isin(list_ids, ids)
+            if not keep.all():
+                lists[list_no] = (list_ids[keep], list_vectors[keep])
+        self._state = (centroids, lists)
+
+    def _search(self, queries: np.ndarray, tolerance: float) -> Tuple[np.ndarray, np.ndarray]:
+        centroids, lists = self._state
+        if not centroids.shape[0]:
+            list_ids, list_vectors = lists[0]
+            best_indices, best_distances = match_face_encodings(queries, list_vectors, tolerance)
+            return _lookup_ids(list_ids, best_indices), best_distances
+
+        nprobe = min(self.nprobe, centroids.shape[0])
+        probes = np.argpartition(squared_distance_matrix(queries, centroids), nprobe - 1, axis=1)[:, :nprobe]
+        best_ids = np.full(queries.shape[0], -1, dtype=np.int64)
+        best_distances = np.full(queries.shape[0], np.inf, dtype=np.float32)
+        for i, query_probes in enumerate(probes):
+            candidate_ids = np.concatenate([lists[l][0] for l in query_probes])
+            candidate_vectors = np.concatenate([lists[l][1] for l in query_probes])
+            best_index, best_distance = match_face_encodings(queries[i:i + 1], candidate_vectors, tolerance)
+            best_distances[i] = best_distance[0]
+            if best_index[0] >= 0:
+                best_ids[i] = candidate_ids[best_index[0]]
+
+        if self.recall_sample_rate and random.random() < self.recall_sample_rate:
+            self._check_recall(queries, best_ids, tolerance)
+        return best_ids, best_distances
+
+    def _check_recall(self, queries: np.ndarray, approximate_ids: np.ndarray, tolerance: float):
+        all_ids, all_vectors = self._all()
+        exact_indices, _ = match_face_encodings(queries, all_vectors, tolerance)
+        exact_ids = _lookup_ids(all_ids, exact_indices)
+        # Only queries with a true match within tolerance count towards recall
+        relevant = exact_ids >= 0
+        self._recall_checked += int(relevant.sum())
+        self._recall_hits += int((approximate_ids[relevant] == exact_ids[relevant]).sum())
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "nlist": len(self._state[1]),
+            "nprobe": self.nprobe,
+            "trained": bool(self._trained_size),
+            "recall_samples": self._recall_checked,
+            "recall": round(self._recall_hits / self._recall_checked, 4) if self._recall_checked else None
+        })
+        return stats
+
+def create_index(backend: str = "flat", **kwargs) -> EmbeddingIndex:
+    backend = backend.strip().lower()
+    if backend == "flat":
+        return FlatIndex()
+    if backend == "ivf":
+        return IVFIndex(**kwargs)
+    raise ValueError(f"Unknown embedding index backend: {backend}. Expected 'flat' or 'ivf'.")
@@ -1,3 +1,4 @@
+import os
 import cv2
 import numpy as np
 import face_recognition
@@ -7,6 +8,8 @@ from models import FaceEmbedding
 # Define constants for filtering
 MIN_FACE_SIZE = 80 # Minimum width or height of a detected face in pixels
 MAX_ASPECT_RATIO = 1.5 # Max width/height or height/width ratio (e.g., 1.5 means 1:1.5 or 1.5:1)
+MATCH_TOLERANCE = 0.5 # Max euclidean distance between two encodings of the same person
+DETECTION_SCALE = float(os.getenv("FACE_DETECTION_SCALE", "1.0")) # <1.0 runs HOG detection on a downscaled copy of classroom frames
 
 def preprocess_image_for_detection(image_bytes: bytes) -> np.ndarray:
     """Loads image bytes and converts to RGB numpy array for face_recognition."""
@@ -38,15 +41,45 @@ def filter_face_locations(face_locations: List[Tuple[int, int, int, int]]) -> Li
     return filtered_locations
 
 
+def detect_face_locations(
+    rgb_image: np.ndarray,
+    detection_scale: Optional[float] = None
+) -> List[Tuple[int, int, int, int]]:
+    """Runs HOG face detection, optionally on a downscaled copy of the image.
+
+    HOG cost grows with pixel count, so large frames are detected at
+    `detection_scale` (full resolution if None) and the boxes are mapped
+    back to original-image coordinates. Encodings should still be computed
+    on the full image.
+    """
+    scale = 1.0 if detection_scale is None else detection_scale
+    if scale >= 1.0:
+        return face_recognition.face_locations(rgb_image, model="hog") # Can use "cnn" for more accuracy if GPU is available
+
+    small_image = cv2.resize(rgb_image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    small_locations = face_recognition.face_locations(small_image, model="hog")
+
+    height, width = rgb_image.shape[:2]
+    return [
+        (
+            max(0, int(round(top / scale))),
+            min(width, int(round(right / scale))),
+            min(height, int(round(bottom / scale))),
+            max(0, int(round(left / scale)))
+        )
+        for top, right, bottom, left in small_locations
+    ]
+
 def extract_face_embeddings_from_image(
     rgb_image: np.ndarray, 
-    known_face_locations: Optional[List[Tuple[int, int, int, int]]] = None
+    known_face_locations: Optional[List[Tuple[int, int, int, int]]] = None,
+    detection_scale: Optional[float] = None
 ) -> List[np.ndarray]:
     """Extracts face embeddings from an RGB image after applying filters."""
-    # Detect faces
-    face_locations = face_recognition.face_locations(rgb_image, model="hog") # Can use "cnn" for more accuracy if GPU is available
+    # Detect faces; registration photos are small, close-up shots, so FACE_DETECTION_SCALE doesn't apply
+    face_locations = detect_face_locations(rgb_image, detection_scale)
     
-    # Apply filtering
+    # Apply filtering (in original-image pixels)
     filtered_face_locations = filter_face_locations(face_locations)
 
     if not filtered_face_locations:
@@ -57,14 +90,49 @@ def extract_face_embeddings_from_image(
     return face_encodings
 
 def get_face_locations_and_embeddings(
-    rgb_image: np.ndarray
+    rgb_image: np.ndarray,
+    detection_scale: Optional[float] = None
 ) -> Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]:
-    """Detects, filters, and extracts embeddings from an RGB image."""
-    face_locations = face_recognition.face_locations(rgb_image, model="hog")
+    """Detects, filters, and extracts embeddings from an RGB image.
+
+    Used for classroom frames, so detection runs at FACE_DETECTION_SCALE unless `detection_scale` is given.
+    """
+    face_locations = detect_face_locations(rgb_image, DETECTION_SCALE if detection_scale is None else detection_scale)
     filtered_face_locations = filter_face_locations(face_locations)
 
     if not filtered_face_locations:
         return [], []
     
     face_encodings = face_recognition.face_encodings(rgb_image, filtered_face_locations)
-    return filtered_face_locations, face_encodings 
\ No newline at end of file
+    return filtered_face_locations, face_encodings 
+
+def squared_distance_matrix(queries: np.ndarray, known_encodings: np.ndarray) -> np.ndarray:
+    """Squared euclidean distances between every query row and every known row."""
+    # ||q - k||^2 = ||q||^2 + ||k||^2 - 2 q.k
+    return (
+        np.einsum("ij,ij->i", queries, queries)[:, None]
+        + np.einsum("ij,ij->i", known_encodings, known_encodings)[None, :]
+        - 2.0 * (queries @ known_encodings.T)
+    )
+
+def match_face_encodings(
+    face_encodings: List[np.ndarray],
+    known_encodings: np.ndarray,
+    tolerance: float = MATCH_TOLERANCE
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Matches all faces against all known encodings in a single pass.
+
+    Builds the full (faces x known) distance matrix with one matrix multiply,
+    equivalent to calling face_recognition.face_distance once per face.
+    Returns the best known index for each face (-1 if no distance is below
+    `tolerance`) and the corresponding distances.
+    """
+    queries = np.asarray(face_encodings, dtype=np.float32).reshape(len(face_encodings), known_encodings.shape[1])
+    if queries.shape[0] == 0 or known_encodings.shape[0] == 0:
+        return np.full(queries.shape[0], -1, dtype=np.intp), np.full(queries.shape[0], np.inf, dtype=np.float32)
+
+    squared_distances = squared_distance_matrix(queries, known_encodings)
+    best_indices = np.argmin(squared_distances, axis=1)
+    best_distances = np.sqrt(np.maximum(squared_distances[np.arange(queries.shape[0]), best_indices], 0.0))
+    best_indices[best_distances >= tolerance] = -1
+    return best_indices, best_distances
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+from typing import Callable, List, Tuple, Optional
+from starlette.concurrency import run_in_threadpool
+from face_service import preprocess_image_for_detection, extract_face_embeddings_from_image, get_face_locations_and_embeddings
+
+# Number of face pipeline processes; 0 runs the pipeline on the event loop's thread pool instead
+FACE_WORKER_PROCESSES = int(os.getenv("FACE_WORKER_PROCESSES", str(max(1, (os.cpu_count() or 2) // 2))))
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _warm_up_worker():
+    """Runs once in each worker so dlib's detector and encoder models are loaded before the first frame."""
+    blank = np.zeros((100, 100, 3), dtype=np.uint8)
+    get_face_locations_and_embeddings(blank)
+    extract_face_embeddings_from_image(blank)
+
+def _run_pipeline(image_bytes, mode: str):
+    """Decodes an image and runs detection + encoding; returns None for undecodable images."""
+    rgb_img = preprocess_image_for_detection(image_bytes)
+    if rgb_img is None:
+        return None
+    if mode == "register":
+        return extract_face_embeddings_from_image(rgb_img)
+    return get_face_locations_and_embeddings(rgb_img)
+
+def _run_pipeline_from_shared_memory(shm_name: str, size: int, mode: str):
+    # Attach to the parent's block; the parent unlinks it once the result is back
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        image_buffer = shm.buf[:size]
+        try:
+            return _run_pipeline(image_buffer, mode)
+        finally:
+            image_buffer.release()
+    finally:
+        shm.close()
+
+def start_face_workers():
+    global _executor
+    if FACE_WORKER_PROCESSES <= 0 or _executor is not None:
+        return
+    # spawn rather than fork: the server process already runs threads and an event loop
+    _executor = ProcessPoolExecutor(
+        max_workers=FACE_WORKER_PROCESSES,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_warm_up_worker
+    )
+    print(f"Started {FACE_WORKER_PROCESSES} face pipeline worker processes.")
+
+def stop_face_workers():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _restart_face_workers(broken: ProcessPoolExecutor):
+    """Replaces a pool that lost a worker process; callers that saw the same broken pool restart it once."""
+    global _executor
+    if _executor is not broken:
+        return
+    print("A face pipeline worker process died; restarting the worker pool.")
+    broken.shutdown(wait=False, cancel_futures=True)
+    _executor = None
+    start_face_workers()
+
+async def _run_in_pool(executor: ProcessPoolExecutor, image_bytes: bytes, mode: str):
+    # Hand the encoded frame over through shared memory instead of pickling it
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(image_bytes)))
+    try:
+        shm.buf[:len(image_bytes)] = image_bytes
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, _run_pipeline_from_shared_memory, shm.name, len(image_bytes), mode)
+    finally:
+        shm.close()
+        shm.unlink()
+
+async def _submit(image_bytes: bytes, mode: str, retry: bool = True):
+    executor = _executor
+    if executor is None:
+        return await run_in_threadpool(_run_pipeline, image_bytes, mode)
+    try:
+        return await _run_in_pool(executor, image_bytes, mode)
+    except BrokenProcessPool:
+        # A worker crashed (e.g. a dlib segfault or OOM kill), which breaks the whole pool
+        if not retry:
+            raise
+        _restart_face_workers(executor)
+        return await _submit(image_bytes, mode, retry=False)
+
+async def detect_and_encode_frame(image_bytes: bytes) -> Optional[Tuple[List[Tuple[int, int, int, int]], List[np.ndarray]]]:
+    """Returns (face_locations, face_encodings) for a frame, or None if the image is invalid."""
+    return await _submit(image_bytes, "frame")
+
+async def encode_registration_image(image_bytes: bytes) -> Optional[List[np.ndarray]]:
+    """Returns the face encodings found in a registration photo, or None if the image is invalid."""
+    return await _submit(image_bytes, "register")
+
+async def encode_registration_images(
+    images: List[bytes],
+    check: Optional[Callable[[int, Optional[List[np.ndarray]]], None]] = None
+) -> List[Optional[List[np.ndarray]]]:
+    """Encodes several registration photos concurrently; results are in input order.
+
+    `check(index, encodings)` runs as each photo finishes. If it raises, the
+    photos still queued or encoding are cancelled and the error propagates.
+    """
+    tasks = [asyncio.ensure_future(encode_registration_image(image_bytes)) for image_bytes in images]
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if check is not None:
+                    check(tasks.index(task), task.result())
+    finally:
+        for task in pending:
+            task.cancel()
+    return [task.result() for task in tasks]
+
@@ -0,0 +1,108 @@
+import os
+import asyncio
+from typing import List, Dict, Any, Optional, Tuple, Callable, Awaitable
+from starlette.concurrency import run_in_threadpool
+from face_workers import detect_and_encode_frame
+from gallery import gallery
+
+# Frames arriving within FRAME_BATCH_MAX_WAIT_MS of each other are recognized together
+FRAME_BATCH_MAX_SIZE = int(os.getenv("FRAME_BATCH_MAX_SIZE", "8"))
+FRAME_BATCH_MAX_WAIT_MS = float(os.getenv("FRAME_BATCH_MAX_WAIT_MS", "5"))
+
+class MicroBatcher:
+    """Collects concurrently submitted items and processes them as one batch.
+
+    The first item of a batch starts a `max_wait_ms` timer; the batch is
+    flushed when the timer fires or `max_batch_size` items are waiting.
+    `process_batch` receives the items in submission order and must return
+    one result per item, which is fanned back out to each `submit` caller.
+    A result that is an exception is raised in that caller only.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_batch_size: int = FRAME_BATCH_MAX_SIZE,
+        max_wait_ms: float = FRAME_BATCH_MAX_WAIT_MS
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max_wait_ms
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.batch_count = 0
+        self.item_count = 0
+
+    async def submit(self, item: Any) -> Any:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size or self.max_wait_ms <= 0:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]):
+        self.batch_count += 1
+        self.item_count += len(batch)
+        try:
+            results = await self.process_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self.batch_count,
+            "frames": self.item_count,
+            "mean_batch_size": round(self.item_count / self.batch_count, 2) if self.batch_count else None
+        }
+
+async def recognize_frame_batch(frames: List[Tuple[bytes, Optional[str], Optional[str]]]) -> List[Optional[Tuple[Any, ...]]]:
+    """Runs detection/encoding for each (image_bytes, class_name, section) frame and matches all faces at once.
+
+    Returns, per frame, None for an undecodable image, the exception its
+    pipeline raised, or (face_locations, best_match_rows, gallery_metadata).
+    """
+    # Frames are encoded in parallel on the worker pool, then matched in one gallery call
+    pipeline_results = await asyncio.gather(
+        *[detect_and_encode_frame(image_bytes) for image_bytes, _, _ in frames],
+        return_exceptions=True
+    )
+    await gallery.ensure_loaded()
+
+    match_requests = []
+    for (_, class_name, section), pipeline_result in zip(frames, pipeline_results):
+        usable = pipeline_result is not None and not isinstance(pipeline_result, BaseException)
+        match_requests.append((pipeline_result[1] if usable else [], class_name, section))
+    match_results, metadata = await run_in_threadpool(gallery.match_batch, match_requests)
+
+    results = []
+    for pipeline_result, (best_rows, _) in zip(pipeline_results, match_results):
+        if pipeline_result is None or isinstance(pipeline_result, BaseException):
+            results.append(pipeline_result)
+        else:
+            results.append((pipeline_result[0], best_rows, metadata))
+    return results
+
+frame_batcher = MicroBatcher(recognize_frame_batch)
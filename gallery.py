@@ -0,0 +1,311 @@
+import os
+import time
+import asyncio
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple, Union
+from models import Student, StudentMatchView, normalize_key
+from database import get_change_counter, get_change_epoch, bump_change_counter
+from face_service import match_face_encodings
+from embedding_index import EMBEDDING_DIM, IVF_DEFAULT_NPROBE, EmbeddingIndex, create_index
+from gallery_snapshot import save_snapshot, load_snapshot
+
+# Directory for memory-mapped gallery snapshots shared by all workers ("" disables them)
+GALLERY_SNAPSHOT_DIR = os.getenv("GALLERY_SNAPSHOT_DIR", "gallery_snapshot")
+# How often a worker checks the students change counter for writes made by other workers
+GALLERY_VERSION_CHECK_SECONDS = float(os.getenv("GALLERY_VERSION_CHECK_SECONDS", "5"))
+
+def partition_key(class_name: str, section: str) -> Tuple[str, str]:
+    return normalize_key(class_name), normalize_key(section)
+
+class EmbeddingGallery:
+    """Process-wide cache of every stored face embedding.
+
+    Vectors live in one contiguous float32 matrix; `metadata[i]` describes the
+    student owning row `i` and `row_slots[i]` is the row's stable id in the
+    nearest-neighbour index. Rows are also indexed by (class_name, section)
+    partition so a frame can be matched against its own class first. The
+    cache is loaded once and then patched in place by the student write
+    endpoints, so recognition never has to query the students collection.
+
+    `version` is the students change counter the cache reflects. Startup
+    loads the on-disk snapshot for the current counter when one exists and
+    only falls back to reading every student from MongoDB otherwise.
+    """
+
+    def __init__(self, index: EmbeddingIndex):
+        self.index = index
+        self.matrix = np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        self.metadata: List[Dict[str, Any]] = []
+        self.row_student_ids = np.empty(0, dtype=object)
+        self.row_slots = np.empty(0, dtype=np.int64)
+        self.partitions: Dict[Tuple[str, str], np.ndarray] = {}
+        self._view = (self.matrix, self.metadata, self.partitions, self.row_slots)
+        self._next_slot = 0
+        self.version = 0
+        self._version_checked_at = 0.0
+        self.loaded = False
+        self._load_lock = asyncio.Lock()
+        self._training_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    @staticmethod
+    def _student_rows(student: Union[Student, StudentMatchView]) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        """Returns the embedding rows and their metadata for a single student."""
+        student_data = {
+            "student_id": str(student.id),
+            "roll_no": student.roll_no,
+            "name": student.name,
+            "class_name": student.class_name,
+            "section": student.section
+        }
+        vectors = [embedding_obj.to_numpy() for embedding_obj in student.face_embeddings]
+        if not vectors:
+            return np.empty((0, EMBEDDING_DIM), dtype=np.float32), []
+        rows = np.stack(vectors).astype(np.float32, copy=False).reshape(len(vectors), EMBEDDING_DIM)
+        return rows, [student_data] * len(vectors)
+
+    def _set_rows(self, matrix: np.ndarray, metadata: List[Dict[str, Any]], row_slots: np.ndarray):
+        # Swap in fresh objects rather than mutating, so readers holding a
+        # snapshot from `view()` in a worker thread are never affected.
+        partition_rows: Dict[Tuple[str, str], List[int]] = {}
+        for row, student_data in enumerate(metadata):
+            key = partition_key(student_data["class_name"], student_data["section"])
+            partition_rows.setdefault(key, []).append(row)
+
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.metadata = metadata
+        self.row_student_ids = np.array([m["student_id"] for m in metadata], dtype=object)
+        self.row_slots = row_slots
+        self.partitions = {key: np.array(rows, dtype=np.intp) for key, rows in partition_rows.items()}
+        self._view = (self.matrix, self.metadata, self.partitions, self.row_slots)
+
+    async def _load_from_database(self) -> Tuple[np.ndarray, List[Dict[str, Any]]]:
+        all_students = await Student.find_all().project(StudentMatchView).to_list()
+        matrices = []
+        metadata = []
+        for student in all_students:
+            rows, rows_metadata = self._student_rows(student)
+            if rows_metadata:
+                matrices.append(rows)
+                metadata.extend(rows_metadata)
+        matrix = np.concatenate(matrices) if matrices else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+        return matrix, metadata
+
+    async def load(self):
+        """(Re)builds the gallery and its index from a snapshot or from MongoDB."""
+        async with self._load_lock:
+            # Read the counter before the data: a concurrent write then at worst
+            # makes the next version check reload again.
+            version = await get_change_counter(Student.Settings.name)
+            snapshot = None
+            if GALLERY_SNAPSHOT_DIR:
+                snapshot_id = (Student.get_motor_collection().database.name, await get_change_epoch(Student.Settings.name))
+                snapshot = await asyncio.to_thread(load_snapshot, GALLERY_SNAPSHOT_DIR, *snapshot_id, version)
+            if snapshot is not None:
+                matrix, metadata = snapshot
+                source = "snapshot"
+            else:
+                matrix, metadata = await self._load_from_database()
+                source = "MongoDB"
+                if GALLERY_SNAPSHOT_DIR:
+                    try:
+                        await asyncio.to_thread(save_snapshot, GALLERY_SNAPSHOT_DIR, *snapshot_id, version, matrix, metadata)
+                    except OSError as e:
+                        print(f"Could not write gallery snapshot: {e}")
+
+            row_slots = np.arange(len(metadata), dtype=np.int64)
+            matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            # Build the new index off the event loop (IVF runs k-means), then swap it in with the rows
+            index = self.index.empty_copy()
+            await asyncio.to_thread(index.reset, row_slots, matrix)
+            self._next_slot = len(metadata)
+            self._set_rows(matrix, metadata, row_slots)
+            self.index = index
+            self.version = version
+            self._version_checked_at = time.monotonic()
+            self.loaded = True
+            print(f"Embedding gallery loaded from {source}: {len(self)} embeddings, version {version} ({self.index.name} index).")
+
+    async def ensure_loaded(self):
+        """Loads the gallery, or reloads it if another worker changed students since the last check."""
+        if self.loaded and time.monotonic() - self._version_checked_at < GALLERY_VERSION_CHECK_SECONDS:
+            return
+        if self.loaded:
+            self._version_checked_at = time.monotonic()
+            if await get_change_counter(Student.Settings.name) == self.version:
+                return
+        await self.load()
+
+    def _train_index_in_background(self):
+        if self._training_task is None or self._training_task.done():
+            self._training_task = asyncio.ensure_future(self._retrain_index())
+
+    async def _retrain_index(self):
+        """Rebuilds the index from the current rows in a worker thread, then swaps it in.
+
+        Rows added or removed while it trained are replayed onto the new index
+        first; a `load` in the meantime supersedes it.
+        """
+        current_index = self.index
+        matrix, _, _, row_slots = self.view()
+        index = current_index.empty_copy()
+        await asyncio.to_thread(index.reset, row_slots, matrix)
+        if self.index is not current_index:
+            return
+        latest_matrix, _, _, latest_slots = self.view()
+        added = ~np.isin(latest_slots, row_slots)
+        index.add(latest_slots[added], latest_matrix[added])
+        index.remove(row_slots[~np.isin(row_slots, latest_slots)])
+        self.index = index
+
+    async def _record_change(self):
+        version = await bump_change_counter(Student.Settings.name)
+        if version == self.version + 1:
+            # Only our own write happened since the last load, so the patched cache is current
+            self.version = version
+
+    def view(self) -> Tuple[np.ndarray, List[Dict[str, Any]], Dict[Tuple[str, str], np.ndarray], np.ndarray]:
+        """Returns a consistent (matrix, metadata, partitions, row_slots) tuple for matching."""
+        return self._view
+
+    @staticmethod
+    def _scope_rows(partitions: Dict[Tuple[str, str], np.ndarray], class_name: str, section: Optional[str]) -> np.ndarray:
+        """Row indices for a class, optionally narrowed to one section."""
+        norm_class = normalize_key(class_name)
+        if section:
+            return partitions.get(partition_key(class_name, section), np.empty(0, dtype=np.intp))
+        rows = [r for (c, _), r in partitions.items() if c == norm_class]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.intp)
+
+    @staticmethod
+    def _slot_rows(row_slots: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        """Maps index slots back to gallery rows; slots missing from this view map to -1."""
+        rows = np.full(len(slots), -1, dtype=np.intp)
+        if not len(row_slots):
+            return rows
+        positions = np.minimum(np.searchsorted(row_slots, slots), len(row_slots) - 1)
+        found = (slots >= 0) & (row_slots[positions] == slots)
+        rows[found] = positions[found]
+        return rows
+
+    def match_batch(
+        self,
+        requests: List[Tuple[List[np.ndarray], Optional[str], Optional[str]]]
+    ) -> Tuple[List[Tuple[np.ndarray, np.ndarray]], List[Dict[str, Any]]]:
+        """Matches the faces of several frames, each given as (face_encodings, class_name, section).
+
+        Frames with a `class_name` are matched exactly against that
+        class/section partition first. All faces still unmatched, from every
+        frame, then go to the global index in a single search. Returns one
+        (row indices, distances) pair per frame plus the metadata the rows
+        refer to; row index -1 means no match within tolerance.
+        """
+        matrix, metadata, partitions, row_slots = self.view()
+        results = []
+        pending_encodings = []
+        pending_faces = []
+        for request_no, (face_encodings, class_name, section) in enumerate(requests):
+            best_rows = np.full(len(face_encodings), -1, dtype=np.intp)
+            best_distances = np.full(len(face_encodings), np.inf, dtype=np.float32)
+            if class_name and len(face_encodings):
+                scope_rows = self._scope_rows(partitions, class_name, section)
+                scope_indices, best_distances = match_face_encodings(face_encodings, matrix[scope_rows])
+                in_scope = scope_indices >= 0
+                best_rows[in_scope] = scope_rows[scope_indices[in_scope]]
+            for face_no in np.flatnonzero(best_rows == -1):
+                pending_encodings.append(face_encodings[face_no])
+                pending_faces.append((request_no, face_no))
+            results.append((best_rows, best_distances))
+
+        if pending_encodings:
+            slots, fallback_distances = self.index.search(pending_encodings)
+            fallback_rows = self._slot_rows(row_slots, slots)
+            for (request_no, face_no), row, distance in zip(pending_faces, fallback_rows, fallback_distances):
+                results[request_no][0][face_no] = row
+                results[request_no][1][face_no] = distance
+        return results, metadata
+
+    def match(
+        self,
+        face_encodings: List[np.ndarray],
+        class_name: Optional[str] = None,
+        section: Optional[str] = None
+    ) -> Tuple[np.ndarray, np.ndarray, List[Dict[str, Any]]]:
+        """Matches one frame's faces, returning (row indices, distances, metadata). See `match_batch`."""
+        results, metadata = self.match_batch([(face_encodings, class_name, section)])
+        best_rows, best_distances = results[0]
+        return best_rows, best_distances, metadata
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "loaded": self.loaded,
+            "version": self.version,
+            "embeddings": len(self),
+            "students": len(set(self.row_student_ids)),
+            "partitions": len(self.partitions),
+            "index": self.index.stats()
+        }
+
+    async def remove_student(self, student_id: str):
+        keep = self.row_student_ids != student_id if self.loaded else None
+        if keep is not None and keep.all() and await get_change_counter(Student.Settings.name) == self.version:
+            # Current and holding no rows for the student: nothing for other servers to reload
+            return
+        await self._record_change()
+        if keep is None or keep.all():
+            return
+        self.index.remove(self.row_slots[~keep])
+        self._set_rows(self.matrix[keep], [m for m, k in zip(self.metadata, keep) if k], self.row_slots[keep])
+
+    async def upsert_student(self, student: Student):
+        """Replaces all rows of `student` with its current embeddings."""
+        await self.upsert_students([student])
+
+    async def upsert_students(self, students: List[Union[Student, StudentMatchView]]):
+        """Replaces all rows of each student with its current embeddings, as one change."""
+        if not students:
+            return
+        await self._record_change()
+        if not self.loaded:
+            # Nothing cached yet; the first load will pick the students up.
+            return
+        # Set lookups: np.isin on object (string) arrays compares every pair
+        replaced_ids = {str(student.id) for student in students}
+        keep = np.fromiter((student_id not in replaced_ids for student_id in self.row_student_ids), dtype=bool, count=len(self.row_student_ids))
+        matrix = self.matrix[keep]
+        metadata = [m for m, k in zip(self.metadata, keep) if k]
+        row_slots = self.row_slots[keep]
+        self.index.remove(self.row_slots[~keep])
+
+        new_rows, new_metadata = [], []
+        for student in students:
+            rows, rows_metadata = self._student_rows(student)
+            new_rows.append(rows)
+            new_metadata.extend(rows_metadata)
+        if new_metadata:
+            rows = np.concatenate(new_rows)
+            # New rows always get the highest slots, which keeps row_slots sorted
+            new_slots = np.arange(self._next_slot, self._next_slot + len(new_metadata), dtype=np.int64)
+            self._next_slot += len(new_metadata)
+            matrix = np.concatenate([matrix, rows])
+            metadata.extend(new_metadata)
+            row_slots = np.concatenate([row_slots, new_slots])
+            self.index.add(new_slots, rows)
+        self._set_rows(matrix, metadata, row_slots)
+        if self.index.needs_training:
+            self._train_index_in_background()
+
+def _index_from_env() -> EmbeddingIndex:
+    backend = os.getenv("EMBEDDING_INDEX_BACKEND", "flat")
+    if backend.strip().lower() == "ivf":
+        return create_index(
+            "ivf",
+            nlist=int(os.getenv("IVF_NLIST", "0")),
+            nprobe=int(os.getenv("IVF_NPROBE", str(IVF_DEFAULT_NPROBE))),
+            recall_sample_rate=float(os.getenv("IVF_RECALL_SAMPLE_RATE", "0.05"))
+        )
+    return create_index(backend)
+
+gallery = EmbeddingGallery(_index_from_env())
@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import numpy as np
+from typing import List, Dict, Any, Optional, Tuple
+
+# Bump when the on-disk layout changes; older snapshots are then ignored.
+SNAPSHOT_FORMAT_VERSION = 2
+SNAPSHOT_KEEP = 2 # Number of most recent snapshots kept on disk
+
+def _snapshot_prefix(database: str, epoch: str) -> str:
+    # The counter alone is not an identity: another database, or a recreated
+    # counter, starts again from 0 with different students
+    return f"gallery-{database}-{epoch}-"
+
+def _snapshot_paths(directory: str, database: str, epoch: str, counter: int) -> Tuple[str, str]:
+    base = os.path.join(directory, f"{_snapshot_prefix(database, epoch)}{counter}")
+    return base + ".npy", base + ".json"
+
+def _snapshot_counters(directory: str, database: str, epoch: str) -> List[int]:
+    prefix = _snapshot_prefix(database, epoch)
+    counters = []
+    for filename in os.listdir(directory):
+        if filename.startswith(prefix) and filename.endswith(".json"):
+            try:
+                counters.append(int(filename[len(prefix):-len(".json")]))
+            except ValueError:
+                continue
+    return sorted(counters)
+
+def save_snapshot(directory: str, database: str, epoch: str, counter: int, matrix: np.ndarray, metadata: List[Dict[str, Any]]):
+    """Writes the gallery matrix and its metadata sidecar for a students change counter.
+
+    `database` and `epoch` (see database.get_change_epoch) identify whose
+    counter it is; a snapshot is only loaded back for the same three values.
+
+    The .npy is renamed into place before the sidecar, so a sidecar on disk
+    always refers to a complete matrix. Files are named by counter and never
+    overwritten, which keeps them safe to mmap from other processes.
+    """
+    os.makedirs(directory, exist_ok=True)
+    matrix_path, sidecar_path = _snapshot_paths(directory, database, epoch, counter)
+    pid = os.getpid()
+
+    tmp_matrix_path = f"{matrix_path}.{pid}.tmp"
+    with open(tmp_matrix_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(matrix, dtype=np.float32))
+    os.replace(tmp_matrix_path, matrix_path)
+
+    # Rows share their student's metadata, so store each student once
+    students: List[Dict[str, Any]] = []
+    student_index: Dict[str, int] = {}
+    row_students = []
+    for student_data in metadata:
+        if student_data["student_id"] not in student_index:
+            student_index[student_data["student_id"]] = len(students)
+            students.append(student_data)
+        row_students.append(student_index[student_data["student_id"]])
+
+    tmp_sidecar_path = f"{sidecar_path}.{pid}.tmp"
+    with open(tmp_sidecar_path, "w") as f:
+        json.dump({
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "database": database,
+            "epoch": epoch,
+            "change_counter": counter,
+            "rows": int(matrix.shape[0]),
+            "students": students,
+            "row_students": row_students
+        }, f)
+    os.replace(tmp_sidecar_path, sidecar_path)
+
+    stale_paths = []
+    for old_counter in _snapshot_counters(directory, database, epoch)[:-SNAPSHOT_KEEP]:
+        stale_paths.extend(_snapshot_paths(directory, database, epoch, old_counter))
+    # Snapshots from an earlier epoch of this database can never be loaded again
+    earlier_epoch = re.compile(re.escape(f"gallery-{database}-") + r"[0-9a-f]{32}-\d+\.(npy|json)$")
+    stale_paths.extend(
+        os.path.join(directory, filename) for filename in os.listdir(directory)
+        if earlier_epoch.match(filename) and not filename.startswith(_snapshot_prefix(database, epoch))
+    )
+    for path in stale_paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def load_snapshot(directory: str, database: str, epoch: str, counter: int) -> Optional[Tuple[np.ndarray, List[Dict[str, Any]]]]:
+    """Memory-maps the snapshot for `counter` of this database and epoch; returns None if it is missing or unusable."""
+    matrix_path, sidecar_path = _snapshot_paths(directory, database, epoch, counter)
+    if not os.path.exists(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path) as f:
+            sidecar = json.load(f)
+        if sidecar.get("format_version") != SNAPSHOT_FORMAT_VERSION:
+            return None
+        if (sidecar.get("database"), sidecar.get("epoch"), sidecar.get("change_counter")) != (database, epoch, counter):
+            return None
+        # Read-only mmap: pages are shared between every worker using this snapshot
+        matrix = np.load(matrix_path, mmap_mode="r")
+        if matrix.dtype != np.float32 or matrix.shape[0] != sidecar["rows"]:
+            return None
+        students = sidecar["students"]
+        metadata = [students[i] for i in sidecar["row_students"]]
+        return matrix, metadata
+    except (OSError, ValueError, KeyError, IndexError) as e:
+        print(f"Ignoring unreadable gallery snapshot {sidecar_path}: {e}")
+        return None
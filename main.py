@@ -1,8 +1,4 @@
 from dotenv import load_dotenv
-import pandas as pd
-import io
-import requests
-from io import BytesIO
 import threading
 import httpx
 
@@ -10,19 +6,30 @@ load_dotenv()
 
 from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Form, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 import numpy as np
 import cv2
 import face_recognition
 import uvicorn
 from database import initiate_database
-from models import Student, FaceEmbedding, AttendanceRecord
+from models import Student, FaceEmbedding, AttendanceRecord, BulkRegistrationJob, StudentSummaryView, StudentEmbeddingIdsView, normalize_key
 from typing import List, Optional
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-from face_service import preprocess_image_for_detection, extract_face_embeddings_from_image, get_face_locations_and_embeddings
-from starlette.concurrency import run_in_threadpool
+from face_workers import start_face_workers, stop_face_workers, encode_registration_images
+from gallery import gallery
+from frame_batcher import frame_batcher
+from attendance_service import mark_students_present, insert_attendance_records, attendance_sessions
+from pagination import fetch_attendance_page, stream_attendance_ndjson, keyset_query
+from attendance_export import stream_attendance_csv, stream_attendance_parquet
+from attendance_summary import count_new_records, count_status_change, read_summary, check_summary_seeded
+from response_cache import response_cache
+from bulk_registration import open_roster, register_roster_rows, close_image_client
+from bulk_jobs import create_job, start_bulk_jobs, stop_bulk_jobs
+from student_service import StudentWrite, upsert_students
 from beanie import PydanticObjectId
+from pymongo.errors import DuplicateKeyError
 
 app = FastAPI()
 
@@ -40,12 +47,19 @@ async def start_database():
     print(f"Using DATABASE_NAME: {DATABASE_NAME}")
     await initiate_database(MONGO_URI, DATABASE_NAME)
     print("MongoDB connection initiated.")
+    await check_summary_seeded()
+    await gallery.load()
+    start_face_workers()
+    await start_bulk_jobs()
 
 @app.on_event("shutdown")
 async def shutdown_database():
     # Beanie handles client closing, but explicit client shutdown might be needed for some use cases.
     # For motor, client.close() is usually handled by Beanie's lifecycle if using Document.find_one/save etc.
     # No direct motor client.close() needed if Beanie manages it.
+    await stop_bulk_jobs()
+    stop_face_workers()
+    await close_image_client()
     print("MongoDB connection closed.")
 
 # Allow CORS for your React Native app
@@ -97,124 +111,46 @@ async def register_student(
     section: str = Form(...),
     images: List[UploadFile] = File(..., description="One or more student face images")
 ):
-    extracted_embeddings = []
-    for img_file in images:
-        contents = await img_file.read()
-        rgb_img = await run_in_threadpool(preprocess_image_for_detection, contents)
+    image_contents = [await img_file.read() for img_file in images]
 
-        if rgb_img is None:
-            raise HTTPException(status_code=400, detail=f"Invalid image format for {img_file.filename}")
-        
-        face_encodings = await run_in_threadpool(extract_face_embeddings_from_image, rgb_img)
+    def check_image(index: int, face_encodings):
+        filename = images[index].filename
+        if face_encodings is None:
+            raise HTTPException(status_code=400, detail=f"Invalid image format for {filename}")
 
         if not face_encodings:
-            raise HTTPException(status_code=400, detail=f"No clear, detectible human faces found in {img_file.filename} (min size 80px, aspect ratio 1:1.5). Please upload a clearer image.")
-
-        extracted_embeddings.append(FaceEmbedding(vector=face_encodings[0].tolist()))
-
-    # Check if student already exists by roll_no and name
-    existing_student = await Student.find_one({"roll_no": roll_no, "name": name})
-    if existing_student:
-        # If student exists, REPLACE their embeddings with the new ones
-        existing_student.face_embeddings = extracted_embeddings
-        await existing_student.save()
-        return {"status": "success", "message": f"Student {name} (Roll No: {roll_no}) embeddings updated.", "student_id": str(existing_student.id)}
-
-    else:
-        # Create new student
-        new_student = Student(
-            roll_no=roll_no,
-            name=name,
-            class_name=class_name,
-            section=section,
-            face_embeddings=extracted_embeddings
-        )
-        await new_student.insert()
-
-        return {"status": "success", "message": f"Student {name} (Roll No: {roll_no}) registered and embeddings stored.", "student_id": str(new_student.id)}
+            raise HTTPException(status_code=400, detail=f"No clear, detectible human faces found in {filename} (min size 80px, aspect ratio 1:1.5). Please upload a clearer image.")
+
+    # All photos are encoded at once on the worker pool; the first bad one cancels the rest
+    encoded_images = await encode_registration_images(image_contents, check_image)
+    extracted_embeddings = [FaceEmbedding.from_numpy(face_encodings[0]) for face_encodings in encoded_images]
+
+    # One upsert on (roll_no, name): an existing student's embeddings are REPLACED with the new ones
+    result, = await upsert_students([StudentWrite(
+        roll_no,
+        name,
+        set_fields={"face_embeddings": [embedding.dict() for embedding in extracted_embeddings]},
+        insert_fields={"class_name": normalize_key(class_name), "section": normalize_key(section)}
+    )])
+    if result.duplicate_roll_no:
+        raise HTTPException(status_code=409, detail=f"Roll No {roll_no} is already registered to another student.")
+    if result.error:
+        raise HTTPException(status_code=500, detail=f"Database error: {result.error}")
+    if result.inserted:
+        return {"status": "success", "message": f"Student {name} (Roll No: {roll_no}) registered and embeddings stored.", "student_id": result.student_id}
+    return {"status": "success", "message": f"Student {name} (Roll No: {roll_no}) embeddings updated.", "student_id": result.student_id}
 
 @app.post("/admin/students/bulk_register_metadata")
 async def bulk_register_metadata(file: UploadFile = File(...)):
     try:
-        contents = await file.read()
-        
-        df = None
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(contents))
-        elif file.filename.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(io.BytesIO(contents))
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type. Please upload a CSV or Excel file.")
-
-        required_columns = {'roll_no', 'name', 'class_name', 'section'}
-        # Normalize column names to check for existence
-        df.columns = df.columns.str.lower().str.replace(' ', '_')
-
-        if not required_columns.issubset(df.columns):
-            missing_cols = required_columns - set(df.columns)
-            raise HTTPException(status_code=400, detail=f"Missing required columns in file: {', '.join(missing_cols)}. Required: roll_no, name, class_name, section.")
-
-        successful_uploads = 0
-        failed_uploads = []
-
-        for index, row in df.iterrows():
-            roll_no = str(row['roll_no']).strip()
-            name = str(row['name']).strip()
-            class_name = str(row['class_name']).strip()
-            section = str(row['section']).strip()
-
-            # Skip if any crucial field is empty
-            if not roll_no or not name or not class_name or not section:
-                failed_uploads.append({"row": index + 2, "message": "Missing required data (roll_no, name, class_name, or section)"})
-                continue
-
-            image_url = row.get('image', '').strip() if 'image' in row else ''
-            extracted_embeddings = []
-
-            if image_url:
-                try:
-                    response = requests.get(image_url)
-                    if response.status_code == 200:
-                        image_bytes = BytesIO(response.content)
-                        rgb_img = await run_in_threadpool(preprocess_image_for_detection, image_bytes.read())
-                        if rgb_img is not None:
-                            face_encodings = await run_in_threadpool(extract_face_embeddings_from_image, rgb_img)
-                            if face_encodings:
-                                extracted_embeddings.append(FaceEmbedding(vector=face_encodings[0].tolist()))
-                            else:
-                                failed_uploads.append({"row": index + 2, "message": f"No face found in image at {image_url}"})
-                        else:
-                            failed_uploads.append({"row": index + 2, "message": f"Invalid image format at {image_url}"})
-                    else:
-                        failed_uploads.append({"row": index + 2, "message": f"Failed to download image from {image_url}"})
-                except Exception as e:
-                    failed_uploads.append({"row": index + 2, "message": f"Error downloading/processing image: {str(e)}"})
-
-            try:
-                # Check if student already exists by roll_no and name
-                existing_student = await Student.find_one({"roll_no": roll_no, "name": name})
-                if existing_student:
-                    # Update existing student's metadata
-                    existing_student.class_name = class_name
-                    existing_student.section = section
-                    if extracted_embeddings:
-                        existing_student.face_embeddings = extracted_embeddings
-                    await existing_student.save()
-                    successful_uploads += 1
-                else:
-                    # Create new student (with or without embeddings)
-                    new_student = Student(
-                        roll_no=roll_no,
-                        name=name,
-                        class_name=class_name,
-                        section=section,
-                        face_embeddings=extracted_embeddings
-                    )
-                    await new_student.insert()
-                    successful_uploads += 1
-
-            except Exception as e:
-                failed_uploads.append({"row": index + 2, "message": f"Database error: {str(e)}"})
+        # Rows are parsed from the spooled upload chunk by chunk as the pipeline consumes them
+        try:
+            roster_rows = open_roster(file.filename, file.file)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # Image downloads and encodes run concurrently ahead of the rows being saved
+        successful_uploads, failed_uploads = await register_roster_rows(roster_rows)
 
         return {
             "status": "success",
@@ -228,33 +164,81 @@ async def bulk_register_metadata(file: UploadFile = File(...)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred during file processing: {str(e)}")
 
+@app.post("/admin/students/bulk_register_jobs")
+async def create_bulk_register_job(file: UploadFile = File(...)):
+    """Queues a CSV/Excel roster for background registration and returns its job ID right away."""
+    try:
+        job = await create_job(file.filename, file.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"status": "success", "job_id": str(job.id), "job_status": job.status, "total_rows": job.total_rows}
+
+@app.get("/admin/students/bulk_register_jobs/{job_id}")
+async def get_bulk_register_job(job_id: PydanticObjectId):
+    """Reports a background registration's progress: processed/failed counts and throughput."""
+    job = await BulkRegistrationJob.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Bulk registration job not found")
+    return {
+        "status": "success",
+        "job_id": str(job.id),
+        "job_status": job.status,
+        "filename": job.filename,
+        "total_rows": job.total_rows,
+        "processed_rows": job.processed_rows,
+        "successful_count": job.successful_count,
+        "failed_count": len(job.failed_records),
+        "failed_records": job.failed_records,
+        "progress_percent": round(job.processed_rows / job.total_rows * 100, 1) if job.total_rows else 100.0,
+        "rows_per_second": job.rows_per_second,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
 @app.get("/admin/students")
-async def get_all_students():
-    """Fetches all student records including their face embeddings."""
+async def get_all_students(include_embeddings: bool = Query(True)):
+    """Fetches all student records, including their face embeddings unless include_embeddings=false."""
+    if not include_embeddings:
+        summaries = await Student.find_all().project(StudentSummaryView).to_list()
+        return {"status": "success", "students": [{**summary.dict(), "id": str(summary.id)} for summary in summaries]}
+
     students = await Student.find_all().to_list()
     # Convert Beanie documents to dictionaries for JSON serialization
-    # Also convert numpy arrays in embeddings to lists if they somehow become numpy types
+    # Embeddings are always returned as lists of floats, whichever encoding they are stored in
     students_data = []
     for student in students:
-        student_dict = student.dict()
-        # Ensure embeddings vectors are lists of floats, not numpy arrays
-        if 'face_embeddings' in student_dict:
-            student_dict['face_embeddings'] = [
-                {'embedding_id': emb['embedding_id'], 'vector': emb['vector']}
-                for emb in student_dict['face_embeddings']
-            ]
+        student_dict = student.dict(exclude={'face_embeddings'})
+        student_dict['face_embeddings'] = [
+            {'embedding_id': emb.embedding_id, 'vector': emb.to_list()}
+            for emb in student.face_embeddings
+        ]
         students_data.append(student_dict)
     return {"status": "success", "students": students_data}
 
-@app.get("/admin/students/{roll_no}", response_model=Student)
+def student_response(student: Student) -> dict:
+    """A single student as returned by the /admin/students/{roll_no} endpoints.
+
+    Embeddings are always lists of floats, whichever encoding they are stored in.
+    """
+    student_dict = student.dict(by_alias=True, exclude={'face_embeddings'})
+    student_dict['_id'] = str(student.id)
+    student_dict['face_embeddings'] = [
+        {'embedding_id': emb.embedding_id, 'vector': emb.to_list()}
+        for emb in student.face_embeddings
+    ]
+    return student_dict
+
+@app.get("/admin/students/{roll_no}")
 async def get_student_by_roll_no(roll_no: str):
     """Fetches a single student record by roll number."""
     student = await Student.find_one(Student.roll_no == roll_no)
     if not student:
         raise HTTPException(status_code=404, detail="Student not found")
-    return student
+    return student_response(student)
 
-@app.put("/admin/students/{roll_no}", response_model=Student)
+@app.put("/admin/students/{roll_no}")
 async def update_student(roll_no: str, name: str = Form(...), class_name: str = Form(...), section: str = Form(...)):
     """Updates a student's metadata (name, class, section)."""
     student = await Student.find_one(Student.roll_no == roll_no)
@@ -262,10 +246,11 @@ async def update_student(roll_no: str, name: str = Form(...), class_name: str =
         raise HTTPException(status_code=404, detail="Student not found")
 
     student.name = name
-    student.class_name = class_name
-    student.section = section
+    student.class_name = normalize_key(class_name)
+    student.section = normalize_key(section)
     await student.save()
-    return student
+    await gallery.upsert_student(student)
+    return student_response(student)
 
 @app.delete("/admin/students/{roll_no}")
 async def delete_student(roll_no: str):
@@ -275,8 +260,19 @@ async def delete_student(roll_no: str):
         raise HTTPException(status_code=404, detail="Student not found")
 
     await student.delete()
+    await gallery.remove_student(str(student.id))
     return {"status": "success", "message": f"Student with roll number {roll_no} has been deleted."}
 
+@app.get("/admin/gallery/stats")
+async def get_gallery_stats():
+    """Reports gallery size, nearest-neighbour index latency/recall and frame batching stats."""
+    return {"status": "success", "gallery": gallery.stats(), "frame_batcher": frame_batcher.stats()}
+
+@app.get("/admin/cache/stats")
+async def get_response_cache_stats():
+    """Reports report-response cache size, hit/miss counters and invalidations."""
+    return {"status": "success", "response_cache": response_cache.stats()}
+
 # --- New Attendance Endpoints ---
 
 @app.post("/attend/process_frame")
@@ -286,7 +282,9 @@ async def process_attendance_frame(
     teacher_name: str = Form(...),
     subject_name: str = Form(...),
     date: Optional[str] = Form(None),
-    class_time: Optional[str] = Form(None)
+    class_time: Optional[str] = Form(None),
+    section: Optional[str] = Form(None),
+    scoped_match: bool = Form(False)
 ):
     print(f"Received frame for attendance in class {class_id} by {teacher_name}")
 
@@ -297,107 +295,59 @@ async def process_attendance_frame(
         class_time = datetime.now().strftime("%H:%M")
 
     contents = await file.read()
-    rgb_img = await run_in_threadpool(preprocess_image_for_detection, contents)
+    # Decoding, detection and encoding run in the face worker processes; frames from
+    # concurrent requests are batched and all their faces matched against the cached
+    # gallery in one vectorized call. With scoped_match, the class/section partition
+    # is tried before the whole school.
+    recognition_result = await frame_batcher.submit((contents, class_id if scoped_match else None, section))
 
-    if rgb_img is None:
+    if recognition_result is None:
         raise HTTPException(status_code=400, detail="Invalid image format for video frame.")
     
-    face_locations, face_encodings = await run_in_threadpool(get_face_locations_and_embeddings, rgb_img)
+    face_locations, best_match_indices, known_student_data = recognition_result
 
     recognized_students = []
     matched_students_ids = set()
 
-    if not face_encodings:
+    if not face_locations:
         return {"status": "success", "recognized_students": [], "message": "No clear, detectible human faces found in the frame."}
 
-    # Fetch all student embeddings from the database
-    all_students = await Student.find_all().to_list()
-    known_face_encodings = []
-    known_student_data = [] # To store details of known students for easy lookup
-
-    for student in all_students:
-        for embedding_obj in student.face_embeddings:
-            known_face_encodings.append(np.array(embedding_obj.vector))
-            known_student_data.append({
-                "student_id": str(student.id),
-                "roll_no": student.roll_no,
-                "name": student.name,
-                "class_name": student.class_name,
-                "section": student.section
-            })
-
-    # Normalize fields for robust matching
-    norm_class_id = class_id.strip().lower()
-    norm_teacher_name = teacher_name.strip().lower()
-    norm_subject_name = subject_name.strip().lower()
-    # We'll also normalize section and student fields
+    # Canonical keys, so records match the exact-match queries of the report endpoints
+    norm_class_id = normalize_key(class_id)
+    norm_teacher_name = normalize_key(teacher_name)
+    norm_subject_name = normalize_key(subject_name)
 
-    for i, face_encoding in enumerate(face_encodings):
+    pending_records = [] # (index into recognized_students, AttendanceRecord) for matched faces
+    for i, best_match_index in enumerate(best_match_indices):
         # Get the corresponding face_location for the current face_encoding
         current_face_location = face_locations[i]
 
-        if known_face_encodings:
-            # Lower tolerance to 0.5
-            matches = await run_in_threadpool(face_recognition.compare_faces, known_face_encodings, face_encoding, tolerance=0.5)
-            face_distances = await run_in_threadpool(face_recognition.face_distance, known_face_encodings, face_encoding)
-            
-            best_match_index = -1
-            if True in matches:
-                # Find the best match (lowest distance among matches)
-                matched_indices = [i for i, x in enumerate(matches) if x]
-                best_match_index = matched_indices[np.argmin(face_distances[matched_indices])]
-
-            # Only accept match if distance is below 0.5
-            if best_match_index != -1 and face_distances[best_match_index] < 0.5:
-                matched_student = known_student_data[best_match_index]
-                student_obj_id = matched_student["student_id"]
-                norm_section = matched_student["section"].strip().lower()
-                # Check if attendance already marked for this subject, student, and day
-                attendance_query = {
-                    "student_id": student_obj_id,
-                    "class_name": norm_class_id,
-                    "date": date,
-                    "teacher_name": norm_teacher_name,
-                    "section": norm_section,
-                    "subject_name": norm_subject_name,
-                    "class_time": class_time
-                }
-                print(f"Attendance query: {attendance_query}")
-                existing_attendance = await AttendanceRecord.find_one(attendance_query)
-                print(f"Existing attendance found: {existing_attendance is not None}")
-                student_response_data = {
-                    **matched_student,
-                    "face_location": list(current_face_location)
-                }
-                if not existing_attendance:
-                    attendance_record = AttendanceRecord(
-                        student_id=student_obj_id,
-                        roll_no=matched_student["roll_no"],
-                        name=matched_student["name"],
-                        class_name=norm_class_id,
-                        section=norm_section,
-                        teacher_name=norm_teacher_name,
-                        date=date,
-                        time=current_time,
-                        status="Present",
-                        subject_name=norm_subject_name,
-                        class_time=class_time
-                    )
-                    await attendance_record.insert()
-                    recognized_students.append({**student_response_data, "status": "Present"})
-                else:
-                    recognized_students.append({**student_response_data, "status": "Already Present"})
-                matched_students_ids.add(student_obj_id)
-            else:
-                # No good match, label as Unknown
-                recognized_students.append({
-                    "student_id": None,
-                    "name": "Unknown",
-                    "face_location": list(current_face_location),
-                    "status": "Unknown"
-                })
+        # Only accept match if distance is below the 0.5 tolerance
+        if best_match_index != -1:
+            matched_student = known_student_data[best_match_index]
+            student_obj_id = matched_student["student_id"]
+            norm_section = normalize_key(matched_student["section"])
+            attendance_record = AttendanceRecord(
+                student_id=student_obj_id,
+                roll_no=matched_student["roll_no"],
+                name=matched_student["name"],
+                class_name=norm_class_id,
+                section=norm_section,
+                teacher_name=norm_teacher_name,
+                date=date,
+                time=current_time,
+                status="Present",
+                subject_name=norm_subject_name,
+                class_time=class_time
+            )
+            recognized_students.append({
+                **matched_student,
+                "face_location": list(current_face_location)
+            })
+            pending_records.append((len(recognized_students) - 1, attendance_record))
+            matched_students_ids.add(student_obj_id)
         else:
-            # No known faces in DB, label as Unknown
+            # No good match (or no known faces in DB), label as Unknown
             recognized_students.append({
                 "student_id": None,
                 "name": "Unknown",
@@ -405,80 +355,101 @@ async def process_attendance_frame(
                 "status": "Unknown"
             })
 
+    # Students the session cache already knows are skipped; the rest are marked in one
+    # unordered bulk upsert that leaves existing records for the session untouched.
+    inserted_flags = await mark_students_present([record for _, record in pending_records])
+    for (response_index, _), inserted in zip(pending_records, inserted_flags):
+        recognized_students[response_index]["status"] = "Present" if inserted else "Already Present"
+    response_cache.invalidate_records([record for (_, record), inserted in zip(pending_records, inserted_flags) if inserted])
+    print(f"Attendance marked for {sum(inserted_flags)} of {len(pending_records)} recognized faces.")
+
     return {"status": "success", "recognized_students": recognized_students}
 
-@app.get("/attendance/{roll_no}")
-async def get_attendance_by_roll_no(roll_no: str):
-    """
-    Retrieve all attendance records for a specific student by their roll number.
-    
-    Args:
-        roll_no (str): The roll number of the student
-        
-    Returns:
-        dict: JSON response containing attendance records for the student
-    """
+def attendance_ndjson_response(query: dict, cursor: Optional[str]) -> StreamingResponse:
+    """Streams all records matching `query` as NDJSON without building the list in memory."""
     try:
-        # Query the attendance_records collection for all documents where roll_no matches
-        attendance_records = await AttendanceRecord.find({"roll_no": roll_no}).to_list()
-        
-        # Convert Beanie documents to dictionaries for JSON serialization
-        records_data = []
-        for record in attendance_records:
-            record_dict = record.dict()
-            # Convert ObjectId to string for JSON serialization
-            record_dict["_id"] = str(record.id)
-            records_data.append(record_dict)
-        
-        return {
-            "status": "success",
-            "roll_no": roll_no,
-            "attendance_records": records_data,
-            "total_records": len(records_data)
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An error occurred while fetching attendance records: {str(e)}")
+        keyset_query(query, cursor) # Reject a malformed cursor before the response starts
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(stream_attendance_ndjson(query, cursor), media_type="application/x-ndjson")
+
+def date_range_query(query: dict, from_date: Optional[str], to_date: Optional[str]) -> dict:
+    """Returns `query` restricted to records dated from_date..to_date (inclusive, "YYYY-MM-DD")."""
+    if not from_date and not to_date:
+        return query
+    recorded_at = {}
+    try:
+        if from_date:
+            recorded_at["$gte"] = datetime.strptime(from_date, "%Y-%m-%d")
+        if to_date:
+            recorded_at["$lt"] = datetime.strptime(to_date, "%Y-%m-%d") + timedelta(days=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="from_date and to_date must be in YYYY-MM-DD format.")
+    return {**query, "recorded_at": recorded_at}
+
+def attendance_filter(
+    date: Optional[str] = None,
+    class_name: Optional[str] = None,
+    section: Optional[str] = None,
+    subject_name: Optional[str] = None,
+    class_time: Optional[str] = None,
+    teacher_name: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
+) -> dict:
+    """MongoDB filter for the optional attendance report/export parameters; unset ones match everything."""
+    query = {}
+    if date:
+        query["date"] = date
+    if class_name:
+        query["class_name"] = normalize_key(class_name)
+    if section:
+        query["section"] = normalize_key(section)
+    if subject_name:
+        query["subject_name"] = normalize_key(subject_name)
+    if class_time:
+        query["class_time"] = class_time
+    if teacher_name:
+        query["teacher_name"] = normalize_key(teacher_name)
+    return date_range_query(query, from_date, to_date)
+
+async def attendance_page_or_400(query: dict, cursor: Optional[str], page_size: Optional[int]):
+    try:
+        return await fetch_attendance_page(query, cursor, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/attendance/report/class", response_model=List[AttendanceRecord])
 async def get_class_attendance_report(
     class_name: str,
     section: str,
     subject_name: str,
-    date: Optional[str] = None
+    date: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None
 ):
     """
-    Get a full attendance report for a specific class, section, and subject on a given date.
-    If no date is provided, it defaults to the current day.
+    Get a full attendance report for a specific class, section, and subject on a given date,
+    or over the from_date..to_date range. With neither, it defaults to the current day.
     """
-    if date is None:
+    if date is None and not (from_date or to_date):
         date = datetime.now().strftime("%Y-%m-%d")
 
     query = {
-        "class_name": class_name.strip().lower(),
-        "section": section.strip().lower(),
-        "subject_name": subject_name.strip().lower(),
-        "date": date
-    }
-
-    records = await AttendanceRecord.find(query).to_list()
-
-    if not records:
-        return []
-
-    return records
-
-@app.get("/attendance/{roll_no}/{subject_name}", response_model=List[AttendanceRecord])
-async def get_student_subject_attendance(roll_no: str, subject_name: str):
-    """
-    Get a student's attendance records for a specific subject.
-    """
-    query = {
-        "roll_no": roll_no,
-        "subject_name": subject_name.strip().lower()
+        "class_name": normalize_key(class_name),
+        "section": normalize_key(section),
+        "subject_name": normalize_key(subject_name)
     }
+    if date:
+        query["date"] = date
+    range_query = date_range_query(query, from_date, to_date)
+    cache_key = response_cache.key("report_class", {**query, "from_date": from_date, "to_date": to_date})
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
-    records = await AttendanceRecord.find(query).sort("date").to_list()
+    records = await AttendanceRecord.find(range_query).to_list()
+    response_cache.set(cache_key, records, **query)
 
     if not records:
         return []
@@ -497,27 +468,37 @@ async def manual_attendance(
     class_time: Optional[str] = Form(None)
 ):
     """Manually create or update an attendance record for a student."""
+    subject_name, teacher_name = normalize_key(subject_name), normalize_key(teacher_name)
+    class_name, section = normalize_key(class_name), normalize_key(section)
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
     if not class_time:
         class_time = datetime.now().strftime("%H:%M")
     
-    student = await Student.find_one(Student.roll_no == roll_no)
+    student = await Student.find_one(Student.roll_no == roll_no).project(StudentSummaryView)
     if not student:
         raise HTTPException(status_code=404, detail=f"Student with roll number {roll_no} not found.")
 
     # Check if a record already exists for this student, subject, and date
-    existing_record = await AttendanceRecord.find_one({
+    day_records = await AttendanceRecord.find({
         "roll_no": roll_no,
         "subject_name": subject_name,
         "date": date
-    })
+    }).to_list()
+    # A record already at this class_time is the one to update; moving another one onto it would duplicate the session
+    existing_record = next((record for record in day_records if record.class_time == class_time), day_records[0] if day_records else None)
 
     if existing_record:
         # If record exists, update its status
+        old_status = existing_record.status
         existing_record.status = status
         existing_record.class_time = class_time
-        await existing_record.save()
+        try:
+            await existing_record.save()
+        except DuplicateKeyError:
+            raise HTTPException(status_code=409, detail=f"Another attendance record for {roll_no} already exists at class time {class_time}.")
+        await count_status_change(existing_record, old_status)
+        response_cache.invalidate_records([existing_record])
         return existing_record
     else:
         # If no record exists, create a new one
@@ -534,7 +515,13 @@ async def manual_attendance(
             time=datetime.now().strftime("%H:%M:%S"),
             class_time=class_time
         )
-        await new_record.insert()
+        try:
+            await new_record.insert()
+        except DuplicateKeyError:
+            # Created concurrently by another request
+            raise HTTPException(status_code=409, detail=f"Attendance for {roll_no} in this session was recorded concurrently; retry to update it.")
+        await count_new_records([new_record])
+        response_cache.invalidate_records([new_record])
         return new_record
 
 @app.put("/attendance/manual/{record_id}", response_model=AttendanceRecord)
@@ -547,8 +534,11 @@ async def update_attendance_status(record_id: str, status: str = Form(...)):
     if not record:
         raise HTTPException(status_code=404, detail="Attendance record not found")
 
+    old_status = record.status
     record.status = status
     await record.save()
+    await count_status_change(record, old_status)
+    response_cache.invalidate_records([record])
     return record
 
 @app.post("/attendance/close_session")
@@ -560,6 +550,7 @@ async def close_attendance_session(
     teacher_name: Optional[str] = Form(None),
     class_time: Optional[str] = Form(None)
 ):
+    class_name, section, subject_name = normalize_key(class_name), normalize_key(section), normalize_key(subject_name)
     if date is None:
         date = datetime.now().strftime("%Y-%m-%d")
     if not class_time:
@@ -567,35 +558,48 @@ async def close_attendance_session(
     students = await Student.find({
         "class_name": class_name,
         "section": section
-    }).to_list()
+    }).project(StudentSummaryView).to_list()
     if not students:
         raise HTTPException(status_code=404, detail="No students found for this class and section.")
-    attendance_records = await AttendanceRecord.find({
+    # Anyone who already has a record for this session (Present, or Absent from an
+    # earlier close) is skipped, so closing the same session twice is a no-op.
+    marked_cursor = AttendanceRecord.get_motor_collection().find({
         "class_name": class_name,
         "section": section,
         "subject_name": subject_name,
         "date": date,
         "class_time": class_time
-    }).to_list()
-    present_roll_nos = {record.roll_no for record in attendance_records if record.status == "Present"}
-    absent_students = []
-    for student in students:
-        if student.roll_no not in present_roll_nos:
-            absent_record = AttendanceRecord(
-                student_id=str(student.id),
-                roll_no=student.roll_no,
-                name=student.name,
-                class_name=class_name,
-                section=section,
-                teacher_name=teacher_name or "",
-                date=date,
-                time=datetime.now().strftime("%H:%M:%S"),
-                status="Absent",
-                subject_name=subject_name,
-                class_time=class_time
-            )
-            await absent_record.insert()
-            absent_students.append({"roll_no": student.roll_no, "name": student.name})
+    }, {"student_id": 1, "_id": 0})
+    marked_student_ids = {doc["student_id"] async for doc in marked_cursor}
+    # The session is over: stop caching its marked students
+    attendance_sessions.close((class_name, section, subject_name, date, class_time))
+    marked_at = datetime.now().strftime("%H:%M:%S")
+    absent_records = [
+        AttendanceRecord(
+            student_id=str(student.id),
+            roll_no=student.roll_no,
+            name=student.name,
+            class_name=class_name,
+            section=section,
+            teacher_name=teacher_name or "",
+            date=date,
+            time=marked_at,
+            status="Absent",
+            subject_name=subject_name,
+            class_time=class_time
+        )
+        for student in students
+        if str(student.id) not in marked_student_ids
+    ]
+    # One unordered insert_many; a concurrent close racing on the same students just
+    # loses on the unique session index.
+    inserted_flags = await insert_attendance_records(absent_records)
+    await count_new_records([record for record, inserted in zip(absent_records, inserted_flags) if inserted])
+    response_cache.invalidate_records([record for record, inserted in zip(absent_records, inserted_flags) if inserted])
+    absent_students = [
+        {"roll_no": record.roll_no, "name": record.name}
+        for record, inserted in zip(absent_records, inserted_flags) if inserted
+    ]
     return {
         "status": "success",
         "absent_marked": absent_students,
@@ -608,37 +612,68 @@ async def get_all_attendance_records(
     class_name: Optional[str] = None,
     section: Optional[str] = None,
     subject_name: Optional[str] = None,
-    class_time: Optional[str] = None
+    class_time: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1),
+    response_format: str = Query("json", alias="format", regex="^(json|ndjson)$")
 ):
-    query = {}
-    if date:
-        query["date"] = date
-    if class_name:
-        query["class_name"] = class_name
-    if section:
-        query["section"] = section
-    if subject_name:
-        query["subject_name"] = subject_name
-    if class_time:
-        query["class_time"] = class_time
-    records = await AttendanceRecord.find(query).to_list()
-    return {"status": "success", "attendance_records": records, "total_records": len(records)}
+    query = attendance_filter(date, class_name, section, subject_name, class_time, from_date=from_date, to_date=to_date)
+    if response_format == "ndjson":
+        return attendance_ndjson_response(query, cursor)
+    cache_key = response_cache.key("report_all", {**query, "cursor": cursor, "page_size": page_size})
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    records, next_cursor = await attendance_page_or_400(query, cursor, page_size)
+    result = {"status": "success", "attendance_records": records, "total_records": len(records), "next_cursor": next_cursor}
+    response_cache.set(cache_key, result, **query)
+    return result
+
+@app.get("/attendance/export")
+async def export_attendance_records(
+    date: Optional[str] = None,
+    class_name: Optional[str] = None,
+    section: Optional[str] = None,
+    subject_name: Optional[str] = None,
+    class_time: Optional[str] = None,
+    teacher_name: Optional[str] = None,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    export_format: str = Query("csv", alias="format", regex="^(csv|parquet)$"),
+    gzip: bool = Query(False)
+):
+    """
+    Download every matching attendance record as CSV or Parquet.
+    Records are streamed from MongoDB in chunks, so memory use doesn't grow with the export size.
+    `gzip` compresses the CSV file, or selects gzip column compression for Parquet.
+    """
+    query = attendance_filter(date, class_name, section, subject_name, class_time, teacher_name, from_date, to_date)
+    if export_format == "parquet":
+        body = stream_attendance_parquet(query, gzip)
+        media_type, filename = "application/vnd.apache.parquet", "attendance.parquet"
+    elif gzip:
+        body = stream_attendance_csv(query, gzip=True)
+        media_type, filename = "application/gzip", "attendance.csv.gz"
+    else:
+        body = stream_attendance_csv(query)
+        media_type, filename = "text/csv", "attendance.csv"
+    return StreamingResponse(body, media_type=media_type, headers={"Content-Disposition": f'attachment; filename="{filename}"'})
 
 @app.get("/students/filter")
 async def get_students_by_class_section(
     class_name: str,
     section: str
 ):
+    # Only embedding IDs are projected; the vectors themselves never leave MongoDB
     students = await Student.find({
-        "class_name": class_name,
-        "section": section
-    }).to_list()
+        "class_name": normalize_key(class_name),
+        "section": normalize_key(section)
+    }).project(StudentEmbeddingIdsView).to_list()
     filtered = []
     for student in students:
-        embedding_ids = [
-            emb.embedding_id if hasattr(emb, 'embedding_id') else emb.get('embedding_id')
-            for emb in getattr(student, 'face_embeddings', [])
-        ]
+        embedding_ids = [emb.embedding_id for emb in student.face_embeddings]
         filtered.append({
             "_id": str(student.id),
             "name": student.name,
@@ -714,11 +749,20 @@ async def attendance_summary_by_subject_and_section(
     teacher_name: Optional[str] = Query(None)
 ):
     match_filter = {
-        "class_name": class_name.strip().lower(),
-        "section": section.strip().lower()
+        "class_name": normalize_key(class_name),
+        "section": normalize_key(section)
     }
     if teacher_name:
-        match_filter["teacher_name"] = teacher_name.strip().lower()
+        match_filter["teacher_name"] = normalize_key(teacher_name)
+    cache_key = response_cache.key("summary", match_filter)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    if not teacher_name:
+        # Served from the materialized counters; they aren't broken down by teacher
+        result = {"status": "success", "data": await read_summary(match_filter["class_name"], match_filter["section"])}
+        response_cache.set(cache_key, result, **match_filter)
+        return result
     print("Summary aggregation with filter:", match_filter)
     # Use Beanie's aggregate method
     pipeline = [
@@ -767,32 +811,129 @@ async def attendance_summary_by_subject_and_section(
     result = []
     async for doc in AttendanceRecord.aggregate(pipeline):
         result.append(doc)
+    response_cache.set(cache_key, {"status": "success", "data": result}, **match_filter)
     return {"status": "success", "data": result}
 
 @app.get("/attendance/by_teacher_class_section")
 async def get_attendance_by_teacher_class_section(
     teacher_name: str = Query(...),
     class_: str = Query(..., alias="class"),
-    section: str = Query(...)
+    section: str = Query(...),
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1),
+    response_format: str = Query("json", alias="format", regex="^(json|ndjson)$")
 ):
     match_filter = {
-        "teacher_name": teacher_name.strip().lower(),
-        "class_name": class_.strip().lower(),
-        "section": section.strip().lower()
+        "teacher_name": normalize_key(teacher_name),
+        "class_name": normalize_key(class_),
+        "section": normalize_key(section)
     }
     print("Querying with filter:", match_filter)
-    records = await AttendanceRecord.find(match_filter).to_list()
+    range_query = date_range_query(match_filter, from_date, to_date)
+    if response_format == "ndjson":
+        return attendance_ndjson_response(range_query, cursor)
+    cache_key = response_cache.key("by_teacher", {**match_filter, "from_date": from_date, "to_date": to_date, "cursor": cursor, "page_size": page_size})
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    records, next_cursor = await attendance_page_or_400(range_query, cursor, page_size)
     records_data = []
     for record in records:
         record_dict = record.dict()
         record_dict["_id"] = str(record.id)
         records_data.append(record_dict)
-    return {
+    result = {
         "status": "success",
         "records": records_data,
-        "count": len(records_data)
+        "count": len(records_data),
+        "next_cursor": next_cursor
+    }
+    response_cache.set(cache_key, result, **match_filter)
+    return result
+
+# Catch-all /attendance/{roll_no}[/{subject_name}] routes are registered last so they
+# don't shadow the fixed /attendance/... paths above.
+@app.get("/attendance/{roll_no}")
+async def get_attendance_by_roll_no(
+    roll_no: str,
+    from_date: Optional[str] = None,
+    to_date: Optional[str] = None,
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = Query(None, ge=1),
+    response_format: str = Query("json", alias="format", regex="^(json|ndjson)$")
+):
+    """
+    Retrieve attendance records for a specific student by their roll number.
+    
+    Args:
+        roll_no (str): The roll number of the student
+        from_date, to_date (str): Optional inclusive "YYYY-MM-DD" date range
+        cursor (str): `next_cursor` from the previous page
+        page_size (int): Records per page (defaults to ATTENDANCE_PAGE_SIZE)
+        format (str): `json` for one page, `ndjson` to stream every record as JSON lines
+        
+    Returns:
+        dict: JSON response containing one page of attendance records for the student
+    """
+    query = date_range_query({"roll_no": roll_no}, from_date, to_date)
+    if response_format == "ndjson":
+        return attendance_ndjson_response(query, cursor)
+    cache_key = response_cache.key("student_attendance", {"roll_no": roll_no, "from_date": from_date, "to_date": to_date, "cursor": cursor, "page_size": page_size})
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    try:
+        # Query the attendance_records collection for one page of documents where roll_no matches
+        attendance_records, next_cursor = await fetch_attendance_page(query, cursor, page_size)
+        
+        # Convert Beanie documents to dictionaries for JSON serialization
+        records_data = []
+        for record in attendance_records:
+            record_dict = record.dict()
+            # Convert ObjectId to string for JSON serialization
+            record_dict["_id"] = str(record.id)
+            records_data.append(record_dict)
+        
+        result = {
+            "status": "success",
+            "roll_no": roll_no,
+            "attendance_records": records_data,
+            "total_records": len(records_data),
+            "next_cursor": next_cursor
+        }
+        response_cache.set(cache_key, result, roll_no=roll_no)
+        return result
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred while fetching attendance records: {str(e)}")
+
+@app.get("/attendance/{roll_no}/{subject_name}", response_model=List[AttendanceRecord])
+async def get_student_subject_attendance(roll_no: str, subject_name: str):
+    """
+    Get a student's attendance records for a specific subject.
+    """
+    query = {
+        "roll_no": roll_no,
+        "subject_name": normalize_key(subject_name)
     }
 
+    cache_key = response_cache.key("student_subject_attendance", query)
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    records = await AttendanceRecord.find(query).sort("date").to_list()
+    response_cache.set(cache_key, records, roll_no=roll_no)
+
+    if not records:
+        return []
+
+    return records
+
 if __name__ == "__main__":
     # For local testing, ensure MONGO_URI and DATABASE_NAME are set in your .env file or environment
     uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
@@ -0,0 +1,49 @@
+import os
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from database import initiate_database
+from models import AttendanceRecord, parse_record_datetime
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+BATCH_SIZE = 500 # Records updated per bulk_write
+
+async def migrate_attendance_dates(dry_run: bool = False):
+    await initiate_database(MONGO_URI, DATABASE_NAME)
+    collection = AttendanceRecord.get_motor_collection()
+
+    operations = []
+    scanned = 0
+    converted = 0
+    unparseable = 0
+    async for doc in collection.find({"recorded_at": None}, {"date": 1, "time": 1}):
+        scanned += 1
+        recorded_at = parse_record_datetime(doc.get("date"), doc.get("time"))
+        if recorded_at is None:
+            unparseable += 1
+            continue
+        converted += 1
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"recorded_at": recorded_at}}))
+        if len(operations) >= BATCH_SIZE and not dry_run:
+            await collection.bulk_write(operations, ordered=False)
+            operations = []
+
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+
+    action = "Would set" if dry_run else "Set"
+    print(f"{action} recorded_at on {converted} of {scanned} attendance records without one.")
+    if unparseable:
+        print(f"Skipped {unparseable} records whose date is not in YYYY-MM-DD format.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the native recorded_at datetime on attendance records from their date/time strings.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report how many records would be updated.")
+    args = parser.parse_args()
+
+    asyncio.run(migrate_attendance_dates(args.dry_run))
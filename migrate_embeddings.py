@@ -0,0 +1,62 @@
+import os
+import asyncio
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+from database import initiate_database
+from models import Student
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+BATCH_SIZE = 500 # Students updated per bulk_write
+
+def convert_embedding(embedding: dict, target: str) -> dict:
+    """Re-encodes one stored embedding sub-document into the target storage format."""
+    if target == "binary":
+        if embedding.get("vector_bin") is not None:
+            return embedding
+        vector_bin = np.asarray(embedding.get("vector", []), dtype="<f4").tobytes()
+        return {"embedding_id": embedding["embedding_id"], "vector": [], "vector_bin": vector_bin}
+    else:
+        if embedding.get("vector_bin") is None:
+            return embedding
+        vector = np.frombuffer(embedding["vector_bin"], dtype="<f4").astype(np.float64).tolist()
+        return {"embedding_id": embedding["embedding_id"], "vector": vector, "vector_bin": None}
+
+async def migrate_embeddings(target: str, dry_run: bool = False):
+    await initiate_database(MONGO_URI, DATABASE_NAME)
+    collection = Student.get_motor_collection()
+
+    operations = []
+    scanned = 0
+    converted = 0
+    async for doc in collection.find({}, {"face_embeddings": 1}):
+        scanned += 1
+        embeddings = doc.get("face_embeddings", [])
+        new_embeddings = [convert_embedding(embedding, target) for embedding in embeddings]
+        if new_embeddings == embeddings:
+            continue
+        converted += 1
+        operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {"face_embeddings": new_embeddings}}))
+        if len(operations) >= BATCH_SIZE and not dry_run:
+            await collection.bulk_write(operations, ordered=False)
+            operations = []
+
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+
+    action = "Would convert" if dry_run else "Converted"
+    print(f"{action} {converted} of {scanned} students to {target} embedding storage.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encode stored face embeddings as compact float32 binary or as float lists.")
+    parser.add_argument("--to", dest="target", choices=["binary", "float"], default="binary",
+                        help="Target storage format (default: binary).")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report how many students would be converted.")
+    args = parser.parse_args()
+
+    asyncio.run(migrate_embeddings(args.target, args.dry_run))
@@ -1,22 +1,114 @@
 from typing import List, Optional
 from datetime import datetime
-from beanie import Document
-from pydantic import Field, BaseModel
+from beanie import Document, Indexed, PydanticObjectId
+from pydantic import Field, BaseModel, root_validator, validator
+from pymongo import IndexModel, ASCENDING
+import numpy as np
 import uuid
+import os
+
+# Fields identifying one student's attendance in one class session; unique per record
+ATTENDANCE_SESSION_KEY = ("student_id", "class_name", "section", "subject_name", "date", "class_time")
+
+def normalize_key(value: Optional[str]) -> Optional[str]:
+    """Canonical form of a class/section/subject/teacher name: trimmed, single-spaced, lower-case.
+
+    Applied on every write and every query, so these fields always match exactly.
+    """
+    if value is None:
+        return None
+    return " ".join(str(value).split()).lower()
+
+# "binary" stores new embeddings as float32 bytes (BSON Binary) instead of a list of 128 doubles
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float")
 
 class FaceEmbedding(BaseModel):
     embedding_id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    vector: List[float]
+    vector: List[float] = []
+    vector_bin: Optional[bytes] = None # Compact little-endian float32 encoding, used instead of `vector` when set
+
+    @root_validator(skip_on_failure=True)
+    def one_encoding(cls, values):
+        if bool(values.get("vector")) == (values.get("vector_bin") is not None):
+            raise ValueError("A face embedding needs exactly one of vector or vector_bin.")
+        return values
+
+    def to_numpy(self) -> np.ndarray:
+        """Returns the embedding as a float32 array, whichever encoding it was stored in."""
+        if self.vector_bin is not None:
+            return np.frombuffer(self.vector_bin, dtype="<f4")
+        return np.asarray(self.vector, dtype=np.float32)
+
+    def to_list(self) -> List[float]:
+        """Returns the embedding as a plain list of floats for JSON responses."""
+        if self.vector_bin is not None:
+            return self.to_numpy().tolist()
+        return self.vector
+
+    @classmethod
+    def from_numpy(cls, vector: np.ndarray, storage: Optional[str] = None, **kwargs) -> "FaceEmbedding":
+        """Builds an embedding using the configured (or given) storage encoding."""
+        if (storage or EMBEDDING_STORAGE) == "binary":
+            return cls(vector_bin=np.asarray(vector, dtype="<f4").tobytes(), **kwargs)
+        return cls(vector=np.asarray(vector, dtype=np.float64).tolist(), **kwargs)
 
 class Student(Document):
-    roll_no: str = Field(unique=True, index=True)
+    roll_no: Indexed(str, unique=True)
     name: str
     class_name: str
     section: str
     face_embeddings: List[FaceEmbedding] = []
 
+    _canonical_keys = validator("class_name", "section", allow_reuse=True)(normalize_key)
+
     class Settings:
         name = "students" # MongoDB collection name
+        indexes = [
+            IndexModel([("class_name", ASCENDING), ("section", ASCENDING)], name="class_section")
+        ]
+
+# --- Projection views: lightweight read models that only pull the fields an endpoint uses ---
+
+class StudentSummaryView(BaseModel):
+    """Student identity fields without any embeddings."""
+    id: PydanticObjectId = Field(alias="_id")
+    roll_no: str
+    name: str
+    class_name: str
+    section: str
+
+class StudentMatchView(StudentSummaryView):
+    """Identity fields plus embedding vectors, as needed for face matching."""
+    face_embeddings: List[FaceEmbedding] = []
+
+class EmbeddingIdView(BaseModel):
+    embedding_id: str
+
+class StudentEmbeddingIdsView(StudentSummaryView):
+    """Identity fields plus embedding IDs only; vectors are never fetched."""
+    face_embeddings: List[EmbeddingIdView] = []
+
+    class Settings:
+        projection = {
+            "_id": 1,
+            "roll_no": 1,
+            "name": 1,
+            "class_name": 1,
+            "section": 1,
+            "face_embeddings.embedding_id": 1
+        }
+
+def parse_record_datetime(date: Optional[str], time: Optional[str]) -> Optional[datetime]:
+    """Combines the "YYYY-MM-DD" date and "HH:MM:SS" time strings; the time is optional, a bad date gives None."""
+    try:
+        day = datetime.strptime(date, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+    try:
+        clock = datetime.strptime(time, "%H:%M:%S")
+    except (TypeError, ValueError):
+        return day
+    return day.replace(hour=clock.hour, minute=clock.minute, second=clock.second)
 
 class AttendanceRecord(Document):
     student_id: str  # MongoDB ObjectId string of the student
@@ -30,6 +122,82 @@ class AttendanceRecord(Document):
     status: str = "Present"
     subject_name: Optional[str] = None  # New field for subject, now optional
     class_time: Optional[str] = None  # New field for class time, optional
+    recorded_at: Optional[datetime] = None # Native datetime of `date` + `time`, used for date-range queries
+
+    _canonical_keys = validator("class_name", "section", "teacher_name", "subject_name", allow_reuse=True)(normalize_key)
+
+    @root_validator(skip_on_failure=True)
+    def fill_recorded_at(cls, values):
+        if values.get("recorded_at") is None:
+            values["recorded_at"] = parse_record_datetime(values.get("date"), values.get("time"))
+        return values
+
+    class Settings:
+        name = "attendance_records" # MongoDB collection name
+        indexes = [
+            IndexModel([(field, ASCENDING) for field in ATTENDANCE_SESSION_KEY], name="unique_student_session", unique=True),
+            # Class reports, close_session, session cache seeding and the summary $match (prefix)
+            IndexModel([("class_name", ASCENDING), ("section", ASCENDING), ("subject_name", ASCENDING), ("date", ASCENDING), ("class_time", ASCENDING)], name="class_section_subject_date"),
+            IndexModel([("teacher_name", ASCENDING), ("class_name", ASCENDING), ("section", ASCENDING)], name="teacher_class_section"),
+            # Per-student history, per-subject history sorted by date, and manual attendance lookups
+            IndexModel([("roll_no", ASCENDING), ("subject_name", ASCENDING), ("date", ASCENDING)], name="roll_subject_date"),
+            # Date-only reports and keyset pagination in (date, _id) order
+            IndexModel([("date", ASCENDING), ("_id", ASCENDING)], name="date_id"),
+            # from_date/to_date range scans, optionally narrowed to a class section
+            IndexModel([("recorded_at", ASCENDING), ("class_name", ASCENDING), ("section", ASCENDING)], name="recorded_at_class_section")
+        ]
+
+# Fields identifying one row of the materialized attendance summary
+ATTENDANCE_SUMMARY_KEY = ("class_name", "section", "subject_name", "roll_no")
+
+class AttendanceSummary(Document):
+    """Per-student, per-subject attendance counters, kept up to date by every attendance write."""
+    class_name: str
+    section: str
+    subject_name: Optional[str] = None
+    roll_no: str
+    name: str
+    present_count: int = 0
+    absent_count: int = 0
+    total: int = 0
+
+    _canonical_keys = validator("class_name", "section", "subject_name", allow_reuse=True)(normalize_key)
+
+    class Settings:
+        name = "attendance_summaries" # MongoDB collection name
+        indexes = [
+            IndexModel([(field, ASCENDING) for field in ATTENDANCE_SUMMARY_KEY], name="unique_summary_key", unique=True)
+        ]
+
+class BulkRegistrationJob(Document):
+    """A bulk student registration running in the background, with its progress."""
+    filename: str
+    roster_file_id: Optional[PydanticObjectId] = None # Uploaded roster in GridFS, deleted when the job finishes
+    status: str = "queued" # queued, running, completed or failed
+    total_rows: int = 0
+    processed_rows: int = 0
+    successful_count: int = 0
+    failed_records: List[dict] = []
+    last_committed_row: int = 1 # Spreadsheet row number of the last row whose result is saved (1 = header)
+    rows_per_second: Optional[float] = None
+    error: Optional[str] = None
+    lease_until: Optional[datetime] = None # Set while a worker owns the job; an expired lease can be taken over
+    lease_owner: Optional[str] = None # Token of the claim holding the lease; progress writes from any other claim are dropped
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+    class Settings:
+        name = "bulk_registration_jobs" # MongoDB collection name
+        indexes = [
+            IndexModel([("status", ASCENDING)], name="status")
+        ]
+
+class ChangeCounter(Document):
+    """Monotonic per-collection write counter, used to tell whether cached data is stale."""
+    collection: Indexed(str, unique=True)
+    counter: int = 0
+    epoch: Optional[str] = None # Random id set when the counter is created; tells a restarted counter apart
 
     class Settings:
-        name = "attendance_records" # MongoDB collection name 
\ No newline at end of file
+        name = "change_counters" # MongoDB collection name
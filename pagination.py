@@ -0,0 +1,64 @@
+import os
+import json
+import base64
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING
+from models import AttendanceRecord
+
+# Records per page when the client doesn't ask for a page size, and the most it may ask for
+ATTENDANCE_PAGE_SIZE = int(os.getenv("ATTENDANCE_PAGE_SIZE", "200"))
+ATTENDANCE_MAX_PAGE_SIZE = int(os.getenv("ATTENDANCE_MAX_PAGE_SIZE", "1000"))
+
+# Pages walk records in (date, _id) order; _id breaks ties between records on the same date
+KEYSET_SORT = [("date", ASCENDING), ("_id", ASCENDING)]
+
+def encode_cursor(doc: Dict[str, Any]) -> str:
+    """Encodes the sort key of the last record on a page as an opaque URL-safe token."""
+    payload = json.dumps({"date": doc["date"], "id": str(doc["_id"])}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, ObjectId]:
+    """Returns the (date, _id) a cursor token points after; raises ValueError for malformed tokens."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return payload["date"], ObjectId(payload["id"])
+    except (ValueError, KeyError, TypeError, InvalidId):
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+def keyset_query(query: Dict[str, Any], cursor: Optional[str]) -> Dict[str, Any]:
+    """Restricts `query` to the records that sort after `cursor`."""
+    if not cursor:
+        return query
+    after_date, after_id = decode_cursor(cursor)
+    after = {"$or": [
+        {"date": {"$gt": after_date}},
+        {"date": after_date, "_id": {"$gt": after_id}}
+    ]}
+    return {"$and": [query, after]} if query else after
+
+def page_size_or_default(page_size: Optional[int]) -> int:
+    return min(page_size or ATTENDANCE_PAGE_SIZE, ATTENDANCE_MAX_PAGE_SIZE)
+
+async def fetch_attendance_page(
+    query: Dict[str, Any],
+    cursor: Optional[str] = None,
+    page_size: Optional[int] = None
+) -> Tuple[List[AttendanceRecord], Optional[str]]:
+    """Returns one page of records matching `query` and the cursor of the next page (None on the last page)."""
+    limit = page_size_or_default(page_size)
+    # One extra record tells us whether another page follows without a count query
+    records = await AttendanceRecord.find(keyset_query(query, cursor)).sort(KEYSET_SORT).limit(limit + 1).to_list()
+    if len(records) <= limit:
+        return records, None
+    records = records[:limit]
+    last = records[-1]
+    return records, encode_cursor({"date": last.date, "_id": last.id})
+
+async def stream_attendance_ndjson(query: Dict[str, Any], cursor: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Yields every record matching `query` (after `cursor`) as one JSON line, straight off the Motor cursor."""
+    collection = AttendanceRecord.get_motor_collection()
+    async for doc in collection.find(keyset_query(query, cursor)).sort(KEYSET_SORT):
+        doc["_id"] = str(doc["_id"])
+        yield (json.dumps(doc, default=str) + "\n").encode()
@@ -0,0 +1,85 @@
+import os
+import asyncio
+import argparse
+from dotenv import load_dotenv
+from pymongo import ReplaceOne, DeleteOne
+from database import initiate_database, bump_change_counter
+from models import AttendanceRecord, AttendanceSummary, ATTENDANCE_SUMMARY_KEY
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+DATABASE_NAME = os.getenv("DATABASE_NAME", "attendify_db")
+BATCH_SIZE = 500 # Summary rows written per bulk_write
+
+COUNTER_FIELDS = ("name", "present_count", "absent_count", "total")
+
+def summary_key(doc: dict) -> tuple:
+    return tuple(doc.get(field) for field in ATTENDANCE_SUMMARY_KEY)
+
+async def recount_summaries() -> dict:
+    """Recomputes every summary row from attendance_records, keyed like ATTENDANCE_SUMMARY_KEY."""
+    pipeline = [
+        {"$group": {
+            "_id": {field: f"${field}" for field in ATTENDANCE_SUMMARY_KEY},
+            "name": {"$last": "$name"},
+            "present_count": {"$sum": {"$cond": [{"$eq": ["$status", "Present"]}, 1, 0]}},
+            "absent_count": {"$sum": {"$cond": [{"$eq": ["$status", "Absent"]}, 1, 0]}},
+            "total": {"$sum": 1}
+        }}
+    ]
+    expected = {}
+    async for doc in AttendanceRecord.get_motor_collection().aggregate(pipeline, allowDiskUse=True):
+        row = {**doc.pop("_id"), **doc}
+        expected[summary_key(row)] = row
+    return expected
+
+async def reconcile_attendance_summary(dry_run: bool = False):
+    """Brings attendance_summaries in line with attendance_records (expects the database to be initialized)."""
+    collection = AttendanceSummary.get_motor_collection()
+    expected = await recount_summaries()
+
+    operations = []
+    corrected = 0
+    removed = 0
+    async for doc in collection.find({}):
+        key = summary_key(doc)
+        row = expected.pop(key, None)
+        if row is None:
+            removed += 1
+            operations.append(DeleteOne({"_id": doc["_id"]}))
+        elif any(doc.get(field) != row[field] for field in COUNTER_FIELDS):
+            corrected += 1
+            operations.append(ReplaceOne({"_id": doc["_id"]}, row))
+        if len(operations) >= BATCH_SIZE and not dry_run:
+            await collection.bulk_write(operations, ordered=False)
+            operations = []
+
+    # Whatever is left in `expected` has no summary row yet
+    added = len(expected)
+    for row in expected.values():
+        operations.append(ReplaceOne({field: row[field] for field in ATTENDANCE_SUMMARY_KEY}, row, upsert=True))
+        if len(operations) >= BATCH_SIZE and not dry_run:
+            await collection.bulk_write(operations, ordered=False)
+            operations = []
+
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+    if not dry_run:
+        # Marks the summary as built from the records (see check_summary_seeded)
+        await bump_change_counter(AttendanceSummary.Settings.name)
+
+    action = "Would fix" if dry_run else "Fixed"
+    print(f"{action} attendance summary drift: {corrected} corrected, {added} added, {removed} removed.")
+
+async def rebuild_attendance_summary(dry_run: bool = False):
+    await initiate_database(MONGO_URI, DATABASE_NAME)
+    await reconcile_attendance_summary(dry_run)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute the materialized attendance summary from attendance_records and fix any drift.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Only report how many summary rows are out of date.")
+    args = parser.parse_args()
+
+    asyncio.run(rebuild_attendance_summary(args.dry_run))
@@ -0,0 +1,107 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+from models import normalize_key
+
+# Most cached responses kept per process; the least recently used is evicted first. 0 disables caching.
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024"))
+
+# Seconds a cached response may be served. Writes from this process invalidate matching
+# entries right away; the TTL bounds staleness from writes made by other workers.
+ENDPOINT_TTL_SECONDS = {
+    "report_class": 15,
+    "report_all": 30,
+    "summary": 60,
+    "by_teacher": 30,
+    "student_attendance": 30,
+    "student_subject_attendance": 30
+}
+
+# Fields a cached response can be scoped to; writes invalidate entries that overlap them
+TAG_FIELDS = ("class_name", "section", "date", "roll_no")
+
+class ResponseCache:
+    """In-process TTL + LRU cache for report responses, invalidated by attendance writes.
+
+    Each entry carries tags for the class_name/section/date/roll_no its data
+    was filtered on; a tag left as None means the response spans all values
+    of that field, so any write touches it. Tags compare in normalize_key form.
+    """
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Tuple[float, Dict[str, Any], Any]]" = OrderedDict()
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def key(endpoint: str, params: Dict[str, Any]) -> Tuple:
+        """Cache key for an endpoint call; unset parameters are dropped and the rest sorted.
+
+        Dict values (MongoDB operators such as a recorded_at range) become sorted item tuples.
+        """
+        return (endpoint,) + tuple(sorted(
+            (name, tuple(sorted(value.items())) if isinstance(value, dict) else value)
+            for name, value in params.items() if value not in (None, "")
+        ))
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        endpoint = key[0]
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+            return entry[2]
+        if entry is not None:
+            del self._entries[key]
+        self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+        return None
+
+    def set(self, key: Tuple, value: Any, **tags: Any):
+        if self.max_entries <= 0:
+            return
+        ttl = ENDPOINT_TTL_SECONDS.get(key[0], 30)
+        normalized_tags = {field: normalize_key(tags.get(field)) for field in TAG_FIELDS}
+        self._entries[key] = (time.monotonic() + ttl, normalized_tags, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, **write: Any):
+        """Drops every entry whose tags overlap a write to the given class_name/section/date/roll_no."""
+        write = {field: normalize_key(write.get(field)) for field in TAG_FIELDS}
+        stale = [
+            key for key, (_, tags, _) in self._entries.items()
+            if all(tags[field] is None or write[field] is None or tags[field] == write[field] for field in TAG_FIELDS)
+        ]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+
+    def invalidate_records(self, records: Iterable[Any]):
+        """Invalidates the responses affected by writing these attendance records."""
+        for write in {tuple(getattr(record, field) for field in TAG_FIELDS) for record in records}:
+            self.invalidate(**dict(zip(TAG_FIELDS, write)))
+
+    def stats(self) -> Dict[str, Any]:
+        hits = sum(self.hits.values())
+        misses = sum(self.misses.values())
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "by_endpoint": {
+                endpoint: {"hits": self.hits.get(endpoint, 0), "misses": self.misses.get(endpoint, 0)}
+                for endpoint in sorted(set(self.hits) | set(self.misses))
+            }
+        }
+
+response_cache = ResponseCache()
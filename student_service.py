@@ -0,0 +1,71 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from models import Student, StudentMatchView
+from database import DUPLICATE_KEY_ERROR
+from gallery import gallery
+
+@dataclass
+class StudentWrite:
+    """An upsert of the student identified by (roll_no, name).
+
+    `set_fields` are written whether the student exists or not;
+    `insert_fields` only when the student is created.
+    """
+    roll_no: str
+    name: str
+    set_fields: Dict[str, Any] = field(default_factory=dict)
+    insert_fields: Dict[str, Any] = field(default_factory=dict)
+
+@dataclass
+class StudentWriteResult:
+    student_id: Optional[str] = None
+    inserted: bool = False
+    error: Optional[str] = None # Write error for this student (e.g. roll_no held by another name)
+    duplicate_roll_no: bool = False
+
+async def upsert_students(writes: List[StudentWrite]) -> List[StudentWriteResult]:
+    """Applies all writes in one unordered bulk_write and patches the gallery once.
+
+    Results are per write, in order. A roll_no already registered under a
+    different name fails that write on the unique roll_no index; the other
+    writes still go through.
+    """
+    if not writes:
+        return []
+
+    operations = []
+    for write in writes:
+        update = {"$setOnInsert": {"roll_no": write.roll_no, "name": write.name, **write.insert_fields}}
+        if write.set_fields:
+            update["$set"] = write.set_fields
+        operations.append(UpdateOne({"roll_no": write.roll_no, "name": write.name}, update, upsert=True))
+
+    results = [StudentWriteResult() for _ in writes]
+    try:
+        bulk_result = await Student.get_motor_collection().bulk_write(operations, ordered=False)
+        details = bulk_result.bulk_api_result
+        upserted_ids = bulk_result.upserted_ids
+    except BulkWriteError as e:
+        details = e.details
+        upserted_ids = {upsert["index"]: upsert["_id"] for upsert in e.details["upserted"]}
+        for error in e.details["writeErrors"]:
+            results[error["index"]].error = error["errmsg"]
+            results[error["index"]].duplicate_roll_no = error["code"] == DUPLICATE_KEY_ERROR
+    for index in upserted_ids:
+        results[index].inserted = True
+
+    # One read of everything written, for the IDs of updated students and the gallery rows
+    written = {(write.roll_no, write.name) for write, result in zip(writes, results) if result.error is None}
+    students = await Student.find({"roll_no": {"$in": [roll_no for roll_no, _ in written]}}).project(StudentMatchView).to_list()
+    students = [student for student in students if (student.roll_no, student.name) in written]
+    student_ids = {(student.roll_no, student.name): str(student.id) for student in students}
+    for write, result in zip(writes, results):
+        if result.error is None:
+            result.student_id = student_ids.get((write.roll_no, write.name))
+
+    # Matched students whose fields were already current leave the gallery (and its change counter) alone
+    if details["nUpserted"] or details["nModified"]:
+        await gallery.upsert_students(students)
+    return results
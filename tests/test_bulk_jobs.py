@@ -0,0 +1,148 @@
+import asyncio
+import io
+from datetime import datetime, timedelta
+import pytest
+from bson import ObjectId
+from gridfs.errors import NoFile
+
+mongomock_motor = pytest.importorskip("mongomock_motor")
+
+import bulk_jobs
+from beanie import init_beanie
+from models import BulkRegistrationJob
+
+ROSTER = "roll_no,name,class_name,section\n" + "".join(f"{i},Student {i},BSCS,B\n" for i in range(10))
+
+class FakeRosterBucket:
+    """Stands in for the GridFS bucket, which mongomock can't back."""
+
+    def __init__(self):
+        self.files = {}
+
+    async def upload_from_stream(self, filename, source):
+        file_id = ObjectId()
+        self.files[file_id] = source.read()
+        return file_id
+
+    async def download_to_stream(self, file_id, destination):
+        if file_id not in self.files:
+            raise NoFile(file_id)
+        destination.write(self.files[file_id])
+
+    async def delete(self, file_id):
+        if self.files.pop(file_id, None) is None:
+            raise NoFile(file_id)
+
+@pytest.fixture
+def jobs(monkeypatch):
+    """Runs each test against an empty mock database with a fake roster bucket and a fake registration."""
+    state = {"bucket": FakeRosterBucket(), "registered": [], "row_delay": 0}
+
+    async def register_rows(roster_rows):
+        for roster_row in roster_rows:
+            await asyncio.sleep(state["row_delay"])
+            state["registered"].append(roster_row.row)
+            yield roster_row, True, []
+
+    monkeypatch.setattr(bulk_jobs, "_roster_bucket", lambda: state["bucket"])
+    monkeypatch.setattr(bulk_jobs, "register_rows", register_rows)
+    monkeypatch.setattr(bulk_jobs, "BULK_JOB_COMMIT_ROWS", 3)
+    return state
+
+def run(test):
+    async def main():
+        await init_beanie(database=mongomock_motor.AsyncMongoMockClient()[f"test_{ObjectId()}"], document_models=[BulkRegistrationJob])
+        bulk_jobs._queue = asyncio.Queue()
+        try:
+            return await test()
+        finally:
+            for handle in bulk_jobs._lease_retries:
+                handle.cancel()
+            bulk_jobs._lease_retries.clear()
+    return asyncio.run(main())
+
+async def make_job(bucket: FakeRosterBucket, **fields) -> BulkRegistrationJob:
+    roster_file_id = await bucket.upload_from_stream("roster.csv", io.BytesIO(ROSTER.encode()))
+    job = BulkRegistrationJob(filename="roster.csv", roster_file_id=roster_file_id, total_rows=10, **fields)
+    await job.insert()
+    return job
+
+def test_job_resumes_after_the_last_commit(jobs):
+    async def test():
+        # An earlier run committed sheet rows 2..5 before the server stopped
+        job = await make_job(jobs["bucket"], status="running", processed_rows=4, successful_count=4, last_committed_row=5)
+        await bulk_jobs.run_job(job.id)
+        return await BulkRegistrationJob.get(job.id)
+
+    job = run(test)
+    assert jobs["registered"] == list(range(6, 12))
+    assert (job.status, job.processed_rows, job.successful_count, job.last_committed_row) == ("completed", 10, 10, 11)
+    assert job.lease_until is None and job.lease_owner is None
+    assert jobs["bucket"].files == {}
+
+def test_live_lease_is_left_to_its_holder(jobs):
+    async def test():
+        job = await make_job(jobs["bucket"], status="running", lease_owner="other",
+                             lease_until=datetime.utcnow() + timedelta(minutes=5))
+        await bulk_jobs.run_job(job.id)
+        return await BulkRegistrationJob.get(job.id)
+
+    job = run(test)
+    assert jobs["registered"] == []
+    assert job.lease_owner == "other" and job.processed_rows == 0
+    assert len(jobs["bucket"].files) == 1
+
+def test_expired_lease_is_taken_over(jobs):
+    async def test():
+        job = await make_job(jobs["bucket"], status="running", lease_owner="crashed", last_committed_row=8, processed_rows=7,
+                             successful_count=7, lease_until=datetime.utcnow() - timedelta(seconds=1))
+        await bulk_jobs.run_job(job.id)
+        return await BulkRegistrationJob.get(job.id)
+
+    job = run(test)
+    assert jobs["registered"] == [9, 10, 11]
+    assert (job.status, job.processed_rows) == ("completed", 10)
+
+def test_worker_that_lost_its_lease_writes_nothing(jobs):
+    jobs["row_delay"] = 0.05
+
+    async def test():
+        job = await make_job(jobs["bucket"])
+        running = asyncio.ensure_future(bulk_jobs.run_job(job.id))
+        await asyncio.sleep(0.02)
+        # Another worker claimed the job (as if this worker's lease had expired)
+        await BulkRegistrationJob.get_motor_collection().update_one({"_id": job.id}, {"$set": {"lease_owner": "other"}})
+        await running
+        return await BulkRegistrationJob.get(job.id)
+
+    job = run(test)
+    assert (job.status, job.processed_rows, job.last_committed_row, job.lease_owner) == ("running", 0, 1, "other")
+    assert len(jobs["bucket"].files) == 1
+
+def test_lease_is_renewed_while_a_slow_batch_runs(jobs, monkeypatch):
+    monkeypatch.setattr(bulk_jobs, "BULK_JOB_LEASE_SECONDS", 0.3)
+    monkeypatch.setattr(bulk_jobs, "BULK_JOB_COMMIT_ROWS", 100)
+    jobs["row_delay"] = 0.1
+
+    async def test():
+        job = await make_job(jobs["bucket"])
+        running = asyncio.ensure_future(bulk_jobs.run_job(job.id))
+        # Well past the lease length, with no progress commit yet
+        await asyncio.sleep(0.7)
+        second_claim = await bulk_jobs._claim(job.id)
+        await running
+        return second_claim, await BulkRegistrationJob.get(job.id)
+
+    second_claim, job = run(test)
+    assert second_claim is None
+    assert (job.status, job.processed_rows) == ("completed", 10)
+
+def test_job_without_stored_roster_fails(jobs):
+    async def test():
+        job = BulkRegistrationJob(filename="roster.csv", total_rows=10)
+        await job.insert()
+        await bulk_jobs.run_job(job.id)
+        return await BulkRegistrationJob.get(job.id)
+
+    job = run(test)
+    assert job.status == "failed" and "upload it again" in job.error
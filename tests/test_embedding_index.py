@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+from embedding_index import EMBEDDING_DIM, IVF_MIN_TRAIN_SIZE, EmbeddingIndex, FlatIndex, IVFIndex
+
+def random_vectors(n: int, seed: int = 0) -> np.ndarray:
+    # Uniform vectors in [0, 1)^128 lie ~4.6 apart, far outside the match tolerance
+    return np.random.default_rng(seed).random((n, EMBEDDING_DIM), dtype=np.float32)
+
+def trained_ivf(n: int = IVF_MIN_TRAIN_SIZE, **kwargs) -> IVFIndex:
+    index = IVFIndex(recall_sample_rate=0, **kwargs)
+    index.reset(np.arange(n), random_vectors(n))
+    return index
+
+def test_base_class_is_abstract():
+    with pytest.raises(TypeError):
+        EmbeddingIndex()
+
+def test_small_ivf_index_is_an_exact_scan():
+    vectors = random_vectors(100)
+    ivf, flat = IVFIndex(recall_sample_rate=0), FlatIndex()
+    ivf.reset(np.arange(100), vectors)
+    flat.reset(np.arange(100), vectors)
+
+    queries = np.concatenate([vectors[[3, 50, 99]], random_vectors(2, seed=1)])
+    ivf_ids, _ = ivf.search(queries)
+    flat_ids, _ = flat.search(queries)
+    assert ivf.stats()["trained"] is False
+    assert ivf_ids.tolist() == flat_ids.tolist() == [3, 50, 99, -1, -1]
+
+def test_trained_ivf_index_finds_stored_vectors():
+    index = trained_ivf(nlist=16)
+    vectors = random_vectors(IVF_MIN_TRAIN_SIZE)
+    sample = np.arange(0, IVF_MIN_TRAIN_SIZE, 97)
+
+    ids, distances = index.search(vectors[sample])
+    assert index.stats()["trained"] is True
+    assert len(index) == IVF_MIN_TRAIN_SIZE
+    assert ids.tolist() == sample.tolist()
+    assert np.all(distances < 0.01)
+
+def test_empty_partitions_are_searchable_and_editable():
+    # Four distinct faces repeated: k-means seeds duplicate centroids, leaving most lists empty
+    base = random_vectors(4)
+    vectors = np.repeat(base, IVF_MIN_TRAIN_SIZE // 4, axis=0)
+    index = IVFIndex(nlist=32, nprobe=2, recall_sample_rate=0)
+    index.reset(np.arange(len(vectors)), vectors)
+    assert any(len(list_ids) == 0 for list_ids, _ in index._state[1])
+
+    ids, _ = index.search(np.concatenate([base, random_vectors(1, seed=1)]))
+    assert [vector_id >= 0 for vector_id in ids] == [True, True, True, True, False]
+
+    new = random_vectors(1, seed=2)
+    index.add(np.array([5000]), new)
+    assert index.search(new)[0].tolist() == [5000]
+    index.remove(np.array([5000]))
+    assert index.search(new)[0].tolist() == [-1]
+    assert len(index) == len(vectors)
+
+def test_remove_drops_vectors_and_ignores_empty_ids():
+    index = trained_ivf(nlist=16)
+    vectors = random_vectors(IVF_MIN_TRAIN_SIZE)
+    index.remove(np.array([], dtype=np.int64))
+    assert len(index) == IVF_MIN_TRAIN_SIZE
+
+    index.remove(np.array([7, 8]))
+    assert len(index) == IVF_MIN_TRAIN_SIZE - 2
+    assert index.search(vectors[[7, 8, 9]])[0].tolist() == [-1, -1, 9]
+
+def test_needs_training_after_the_index_doubles():
+    index = IVFIndex(recall_sample_rate=0)
+    index.add(np.arange(IVF_MIN_TRAIN_SIZE - 1), random_vectors(IVF_MIN_TRAIN_SIZE - 1))
+    assert not index.needs_training
+    index.add(np.array([IVF_MIN_TRAIN_SIZE]), random_vectors(1, seed=1))
+    assert index.needs_training
+
+    index = trained_ivf()
+    assert not index.needs_training
+    index.add(np.arange(10_000, 10_000 + IVF_MIN_TRAIN_SIZE), random_vectors(IVF_MIN_TRAIN_SIZE, seed=1))
+    assert index.needs_training
+
+def test_empty_copy_keeps_settings_and_search_stats():
+    index = trained_ivf(nlist=16, nprobe=4)
+    index.search(random_vectors(3, seed=1))
+
+    copy = index.empty_copy()
+    assert isinstance(copy, IVFIndex) and len(copy) == 0
+    assert (copy.nlist, copy.nprobe) == (16, 4)
+    assert copy.stats()["searches"] == 1 and copy.stats()["queries"] == 3
+    assert copy._stats_lock is index._stats_lock
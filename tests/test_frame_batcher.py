@@ -0,0 +1,73 @@
+import asyncio
+from frame_batcher import MicroBatcher
+
+def run_batcher(items, process_batch, **kwargs):
+    async def run():
+        batcher = MicroBatcher(process_batch, **kwargs)
+        results = await asyncio.gather(*[batcher.submit(item) for item in items], return_exceptions=True)
+        return batcher, results
+    return asyncio.run(run())
+
+def test_concurrent_items_share_a_batch_and_get_their_own_results():
+    batches = []
+    async def double(items):
+        batches.append(list(items))
+        return [item * 2 for item in items]
+
+    batcher, results = run_batcher([1, 2, 3], double, max_batch_size=8, max_wait_ms=50)
+    assert results == [2, 4, 6]
+    assert batches == [[1, 2, 3]]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["mean_batch_size"] == 3
+
+def test_full_batch_flushes_without_waiting_for_the_timer():
+    batches = []
+    async def echo(items):
+        batches.append(list(items))
+        return items
+
+    async def run():
+        batcher = MicroBatcher(echo, max_batch_size=2, max_wait_ms=60_000)
+        return await asyncio.wait_for(asyncio.gather(*[batcher.submit(i) for i in range(4)]), timeout=5)
+
+    assert asyncio.run(run()) == [0, 1, 2, 3]
+    assert batches == [[0, 1], [2, 3]]
+
+def test_zero_wait_processes_each_item_alone():
+    batches = []
+    async def echo(items):
+        batches.append(list(items))
+        return items
+
+    _, results = run_batcher(["a", "b"], echo, max_wait_ms=0)
+    assert results == ["a", "b"]
+    assert batches == [["a"], ["b"]]
+
+def test_exception_result_is_raised_in_its_caller_only():
+    async def process(items):
+        return [ValueError(item) if item == "bad" else item for item in items]
+
+    _, results = run_batcher(["ok", "bad", "fine"], process, max_wait_ms=20)
+    assert results[0] == "ok" and results[2] == "fine"
+    assert isinstance(results[1], ValueError)
+
+def test_failed_batch_raises_in_every_caller():
+    async def fail(items):
+        raise RuntimeError("pool died")
+
+    _, results = run_batcher([1, 2], fail, max_wait_ms=20)
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_submit_after_a_flush_starts_a_new_batch():
+    batches = []
+    async def echo(items):
+        batches.append(list(items))
+        return items
+
+    async def run():
+        batcher = MicroBatcher(echo, max_batch_size=8, max_wait_ms=5)
+        first = await batcher.submit(1)
+        second = await batcher.submit(2)
+        return first, second
+
+    assert asyncio.run(run()) == (1, 2)
+    assert batches == [[1], [2]]
@@ -0,0 +1,48 @@
+import asyncio
+import pytest
+from bson import ObjectId
+from pagination import decode_cursor, encode_cursor, keyset_query
+
+def test_cursor_round_trip():
+    record_id = ObjectId()
+    assert decode_cursor(encode_cursor({"date": "2026-03-01", "_id": record_id})) == ("2026-03-01", record_id)
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "e30=", encode_cursor({"date": "2026-03-01", "_id": "not-an-id"})])
+def test_malformed_cursor_raises_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_keyset_query_breaks_date_ties_on_id():
+    record_id = ObjectId()
+    after = {"$or": [{"date": {"$gt": "2026-03-01"}}, {"date": "2026-03-01", "_id": {"$gt": record_id}}]}
+    cursor = encode_cursor({"date": "2026-03-01", "_id": record_id})
+    assert keyset_query({}, None) == {}
+    assert keyset_query({}, cursor) == after
+    assert keyset_query({"section": "b"}, cursor) == {"$and": [{"section": "b"}, after]}
+
+def test_pages_cover_every_record_once_across_date_ties():
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    from beanie import init_beanie
+    from models import AttendanceRecord
+    from pagination import fetch_attendance_page
+
+    async def run():
+        await init_beanie(database=mongomock_motor.AsyncMongoMockClient()["test_pagination"], document_models=[AttendanceRecord])
+        # Seven records share one date, so most page boundaries fall inside a tie
+        dates = ["2026-03-01"] * 7 + ["2026-03-02"] * 2 + ["2026-02-28"]
+        for i, date in enumerate(dates):
+            await AttendanceRecord(student_id=str(i), roll_no=str(i), name="n", class_name="c", section="s",
+                                   teacher_name="t", date=date, time="09:00:00", subject_name="m", class_time=str(i)).insert()
+
+        pages, cursor = [], None
+        while True:
+            records, cursor = await fetch_attendance_page({"section": "s"}, cursor, page_size=3)
+            pages.append([record.roll_no for record in records])
+            if cursor is None:
+                return pages, dates
+
+    pages, dates = asyncio.run(run())
+    assert [len(page) for page in pages] == [3, 3, 3, 1]
+    roll_nos = [roll_no for page in pages for roll_no in page]
+    assert sorted(roll_nos, key=int) == [str(i) for i in range(len(dates))]
+    assert [dates[int(roll_no)] for roll_no in roll_nos] == sorted(dates)
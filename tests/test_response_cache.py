@@ -0,0 +1,56 @@
+from types import SimpleNamespace
+import response_cache
+from response_cache import ResponseCache
+
+def cached(cache: ResponseCache, endpoint: str, **tags) -> tuple:
+    key = cache.key(endpoint, tags)
+    cache.set(key, {"endpoint": endpoint, **tags}, **tags)
+    return key
+
+def test_key_ignores_unset_parameters_and_order():
+    assert ResponseCache.key("report_all", {"section": "b", "date": None, "class_name": "bscs", "cursor": ""}) == \
+        ResponseCache.key("report_all", {"class_name": "bscs", "section": "b"})
+
+def test_write_invalidates_only_overlapping_entries():
+    cache = ResponseCache()
+    same_class = cached(cache, "report_class", class_name="bscs", section="b", date="2026-03-01")
+    other_section = cached(cache, "report_class", class_name="bscs", section="a", date="2026-03-01")
+    other_date = cached(cache, "report_class", class_name="bscs", section="b", date="2026-03-02")
+    all_classes = cached(cache, "report_all")
+
+    cache.invalidate(class_name="BSCS", section=" B ", date="2026-03-01", roll_no="7")
+
+    assert cache.get(same_class) is None
+    assert cache.get(all_classes) is None
+    assert cache.get(other_section) is not None
+    assert cache.get(other_date) is not None
+    assert cache.invalidations == 2
+
+def test_invalidate_records_uses_each_record_tags():
+    cache = ResponseCache()
+    student = cached(cache, "student_attendance", roll_no="7")
+    other_student = cached(cache, "student_attendance", roll_no="8")
+    record = SimpleNamespace(class_name="bscs", section="b", date="2026-03-01", roll_no="7")
+
+    cache.invalidate_records([record, record])
+
+    assert cache.get(student) is None
+    assert cache.get(other_student) is not None
+
+def test_entries_expire_and_least_recently_used_is_evicted(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(response_cache.time, "monotonic", lambda: now[0])
+    cache = ResponseCache(max_entries=2)
+    first = cached(cache, "report_all", section="a")
+    second = cached(cache, "report_all", section="b")
+    cache.get(first)
+    third = cached(cache, "report_all", section="c")
+
+    assert cache.get(second) is None
+    assert cache.evictions == 1
+    now[0] += response_cache.ENDPOINT_TTL_SECONDS["report_all"] + 1
+    assert cache.get(first) is None and cache.get(third) is None
+
+def test_zero_max_entries_disables_caching():
+    cache = ResponseCache(max_entries=0)
+    assert cache.get(cached(cache, "summary", class_name="bscs")) is None